@@ -0,0 +1,254 @@
+import argparse
+import hashlib
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+SIZE_UNITS = {'B': 1, 'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3}
+DEFAULT_SIZES = ['1KB', '64KB', '1MB', '16MB', '128MB']
+FULL_SIZES = DEFAULT_SIZES + ['1GB', '4GB']
+DEFAULT_LIST_COUNTS = [1000, 10000]
+FULL_LIST_COUNTS = DEFAULT_LIST_COUNTS + [100000, 1000000]
+HASH_BUFFER_SIZE = 16 * 1024 * 1024
+
+def parse_size(text):
+    """Turn '64KB' or '4GB' into a byte count"""
+    text = text.strip().upper()
+    for unit in sorted(SIZE_UNITS, key=len, reverse=True):
+        if text.endswith(unit):
+            return int(float(text[:-len(unit)]) * SIZE_UNITS[unit])
+    return int(text)
+
+def start_test_server(storage_dir, **options):
+    """Run a FileServer on a free loopback port in a background thread"""
+    from server import FileServer
+
+    server = FileServer(host='127.0.0.1', port=0, storage_dir=storage_dir, **options)
+    threading.Thread(target=server.start, daemon=True).start()
+    if not server.ready.wait(10):
+        raise RuntimeError("Server did not start")
+    return server
+
+def connect_client(server):
+    from client import FileClient
+
+    client = FileClient(server.host, server.port)
+    if not client.connect():
+        raise RuntimeError("Could not connect to server")
+    return client
+
+def write_test_file(path, size):
+    """Write size bytes of incompressible data without holding it all in memory"""
+    block = os.urandom(min(size, 1024 * 1024))
+    with open(path, 'wb') as f:
+        remaining = size
+        while remaining > 0:
+            f.write(block[:remaining])
+            remaining -= len(block)
+
+def summarize(timings, size=None):
+    """Reduce repeated timings to median, min and, for transfers, MB/s"""
+    median = statistics.median(timings)
+    result = {
+        'median_s': median,
+        'min_s': min(timings),
+        'runs': len(timings)
+    }
+    if size:
+        result['throughput_mb_s'] = size / median / SIZE_UNITS['MB'] if median > 0 else 0.0
+    return result
+
+def bench_hashing(sizes, repeat):
+    """SHA-256 cost over in-memory data, with no disk or socket involved"""
+    results = {}
+    buffer = os.urandom(min(max(sizes.values()), HASH_BUFFER_SIZE))
+    for label, size in sizes.items():
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            hash_obj = hashlib.sha256()
+            remaining = size
+            while remaining > 0:
+                piece = min(remaining, len(buffer))
+                hash_obj.update(memoryview(buffer)[:piece])
+                remaining -= piece
+            hash_obj.hexdigest()
+            timings.append(time.perf_counter() - start)
+        results[f'hash.{label}'] = summarize(timings, size)
+    return results
+
+def bench_transfers(workdir, sizes, repeat):
+    """Upload and download throughput over loopback for each file size"""
+    results = {}
+    server = start_test_server(os.path.join(workdir, 'transfer_store'))
+    client = connect_client(server)
+    download_dir = os.path.join(workdir, 'transfer_downloads')
+    os.makedirs(download_dir, exist_ok=True)
+
+    try:
+        for label, size in sizes.items():
+            source_path = os.path.join(workdir, f'bench_{label}.bin')
+            write_test_file(source_path, size)
+            filename = os.path.basename(source_path)
+
+            upload_timings = []
+            download_timings = []
+            for _ in range(repeat):
+                if server.file_exists(filename):
+                    server.remove_file(filename)
+
+                start = time.perf_counter()
+                success, message = client.upload_file(source_path)
+                upload_timings.append(time.perf_counter() - start)
+                if not success:
+                    raise RuntimeError(f"Upload of {label} failed: {message}")
+
+                start = time.perf_counter()
+                success, message = client.download_file(filename, download_dir, use_cache=False)
+                download_timings.append(time.perf_counter() - start)
+                if not success:
+                    raise RuntimeError(f"Download of {label} failed: {message}")
+                shutil.rmtree(download_dir)
+                os.makedirs(download_dir)
+
+            results[f'upload.{label}'] = summarize(upload_timings, size)
+            results[f'download.{label}'] = summarize(download_timings, size)
+            os.remove(source_path)
+            server.remove_file(filename)
+            print(f"  {label}: upload {results[f'upload.{label}']['throughput_mb_s']:.1f} MB/s, "
+                  f"download {results[f'download.{label}']['throughput_mb_s']:.1f} MB/s")
+    finally:
+        client.disconnect()
+        server.stop()
+    return results
+
+def bench_listing(workdir, counts, repeat):
+    """LIST latency against stores holding count files"""
+    results = {}
+    for count in counts:
+        storage_dir = os.path.join(workdir, f'list_store_{count}')
+        os.makedirs(storage_dir)
+        for i in range(count):
+            with open(os.path.join(storage_dir, f'file_{i:07d}.txt'), 'wb') as f:
+                f.write(b'x')
+
+        server = start_test_server(storage_dir)
+        client = connect_client(server)
+        try:
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                files = client.list_files()
+                timings.append(time.perf_counter() - start)
+                if files is None or len(files) != count:
+                    raise RuntimeError(f"LIST of {count} files failed")
+            results[f'list.{count}'] = summarize(timings)
+            print(f"  {count} files: {results[f'list.{count}']['median_s'] * 1000:.1f} ms")
+        finally:
+            client.disconnect()
+            server.stop()
+            shutil.rmtree(storage_dir)
+    return results
+
+def compare(results, baseline, threshold, min_delta):
+    """Return (name, baseline, current, change) for every slowdown past threshold.
+
+    Slowdowns smaller than min_delta seconds are ignored so timer noise on
+    sub-millisecond measurements does not fail the run.
+    """
+    regressions = []
+    for name, result in sorted(results.items()):
+        previous = baseline.get('results', {}).get(name)
+        if previous is None or not previous.get('median_s'):
+            continue
+        change = result['median_s'] / previous['median_s'] - 1
+        regressed = change > threshold and result['median_s'] - previous['median_s'] > min_delta
+        marker = 'REGRESSION' if regressed else ''
+        print(f"  {name:<20} {previous['median_s'] * 1000:10.2f} ms -> {result['median_s'] * 1000:10.2f} ms "
+              f"{change:+7.1%} {marker}")
+        if regressed:
+            regressions.append((name, previous['median_s'], result['median_s'], change))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the file server's transfer, hashing and listing hot paths")
+    parser.add_argument('--sizes', help="comma-separated file sizes, e.g. 1KB,1MB,1GB")
+    parser.add_argument('--list-counts', help="comma-separated directory sizes for LIST, e.g. 1000,100000")
+    parser.add_argument('--full', action='store_true', help="include 1 GB/4 GB files and 100k/1M-file listings")
+    parser.add_argument('--repeat', type=int, default=5, help="runs per measurement (median is reported)")
+    parser.add_argument('--skip', default='', help="comma-separated groups to skip: hash,transfer,list")
+    parser.add_argument('--output', default='benchmark_results.json', help="where to write results")
+    parser.add_argument('--compare', help="baseline results file to compare against")
+    parser.add_argument('--threshold', type=float, default=0.10, help="allowed slowdown before failing (0.10 = 10%%)")
+    parser.add_argument('--min-delta-ms', type=float, default=1.0, help="ignore slowdowns smaller than this")
+    parser.add_argument('--workdir', help="scratch directory (default: a temporary directory)")
+    args = parser.parse_args(argv)
+
+    size_labels = args.sizes.split(',') if args.sizes else (FULL_SIZES if args.full else DEFAULT_SIZES)
+    sizes = {label.strip().upper(): parse_size(label) for label in size_labels}
+    if args.list_counts:
+        counts = [int(count) for count in args.list_counts.split(',')]
+    else:
+        counts = FULL_LIST_COUNTS if args.full else DEFAULT_LIST_COUNTS
+    skip = {group.strip() for group in args.skip.split(',') if group.strip()}
+
+    output_path = os.path.abspath(args.output)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    # Server and client log and store files relative to the working directory
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    workdir = args.workdir or tempfile.mkdtemp(prefix='fileshare-bench-')
+    os.makedirs(workdir, exist_ok=True)
+    original_dir = os.getcwd()
+    os.chdir(workdir)
+
+    results = {}
+    try:
+        if 'hash' not in skip:
+            print("Hashing (in memory)")
+            results.update(bench_hashing(sizes, args.repeat))
+        if 'transfer' not in skip:
+            print("Transfers (loopback)")
+            results.update(bench_transfers(workdir, sizes, args.repeat))
+        if 'list' not in skip:
+            print("LIST latency")
+            results.update(bench_listing(workdir, counts, args.repeat))
+    finally:
+        os.chdir(original_dir)
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'repeat': args.repeat
+        },
+        'results': results
+    }
+    with open(output_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output_path}")
+
+    if baseline is not None:
+        print(f"Comparison against {args.compare} (threshold {args.threshold:.0%})")
+        regressions = compare(results, baseline, args.threshold, args.min_delta_ms / 1000)
+        if regressions:
+            print(f"FAILED: {len(regressions)} benchmark(s) regressed")
+            return 1
+        print("No regressions")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,3 +1,4 @@
+import getpass
 import socket
 import threading
 import tkinter as tk
@@ -7,6 +8,7 @@ import os
 import hashlib
 import logging
 import time
+from content_cache import ContentCache
 
 # Configure logging
 logging.basicConfig(
@@ -15,18 +17,125 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
+class TransferEventBus:
+    """Publishes transfer events to any number of subscribers.
+    
+    Events are dicts with a 'type' of started, progress, completed or
+    failed. Subscribers are called on the transfer's thread, so GUI
+    subscribers must hand events over to their own thread.
+    """
+    
+    def __init__(self, interval=0.1):
+        self.interval = interval
+        self.subscribers = []
+        self.lock = threading.Lock()
+    
+    def subscribe(self, callback):
+        """Register callback(event) for every transfer event"""
+        with self.lock:
+            self.subscribers = self.subscribers + [callback]
+    
+    def unsubscribe(self, callback):
+        """Stop sending events to callback"""
+        with self.lock:
+            self.subscribers = [subscriber for subscriber in self.subscribers if subscriber != callback]
+    
+    def publish(self, event):
+        """Send an event to every subscriber"""
+        for subscriber in self.subscribers:
+            try:
+                subscriber(event)
+            except Exception as e:
+                logging.error(f"Error in transfer event subscriber: {e}")
+
+class TransferProgress:
+    """Tracks one transfer and publishes coalesced progress events.
+    
+    update() is cheap enough to call per chunk; a progress event with the
+    current rate, moving-average throughput and ETA is published at most
+    once per bus interval.
+    """
+    
+    def __init__(self, bus, direction, filename, total, progress_callback=None, smoothing=0.3):
+        self.bus = bus
+        self.direction = direction
+        self.filename = filename
+        self.total = total
+        self.progress_callback = progress_callback
+        self.smoothing = smoothing
+        self.transferred = 0
+        self.start_time = time.monotonic()
+        self.last_emit_time = self.start_time
+        self.last_emit_bytes = 0
+        self.rate = 0.0
+        self.avg_rate = None
+        self.emit('started')
+    
+    def update(self, size):
+        """Record size more bytes transferred"""
+        self.transferred += size
+        now = time.monotonic()
+        if now - self.last_emit_time >= self.bus.interval:
+            self.rate = (self.transferred - self.last_emit_bytes) / (now - self.last_emit_time)
+            if self.avg_rate is None:
+                self.avg_rate = self.rate
+            else:
+                self.avg_rate = self.smoothing * self.rate + (1 - self.smoothing) * self.avg_rate
+            self.last_emit_time = now
+            self.last_emit_bytes = self.transferred
+            self.emit('progress')
+    
+    def finish(self, success, message=''):
+        """Publish the final event for the transfer"""
+        elapsed = time.monotonic() - self.start_time
+        self.rate = self.transferred / elapsed if elapsed > 0 else 0.0
+        self.avg_rate = self.rate
+        self.emit('completed' if success else 'failed', message=message)
+    
+    def emit(self, event_type, **extra):
+        percent = (self.transferred / self.total) * 100 if self.total else 100.0
+        eta = None
+        if self.avg_rate:
+            eta = max(self.total - self.transferred, 0) / self.avg_rate
+        event = {
+            'type': event_type,
+            'direction': self.direction,
+            'filename': self.filename,
+            'bytes': self.transferred,
+            'total': self.total,
+            'percent': percent,
+            'rate': self.rate,
+            'avg_rate': self.avg_rate or 0.0,
+            'eta': eta,
+            'elapsed': time.monotonic() - self.start_time
+        }
+        event.update(extra)
+        self.bus.publish(event)
+        
+        if self.progress_callback and event_type in ('progress', 'completed'):
+            self.progress_callback(percent)
+
 class FileClient:
-    def __init__(self, host='localhost', port=9999):
+    def __init__(self, host='localhost', port=9999, user=None):
         self.host = host
         self.port = port
+        # Identity that uploads are charged to for quotas
+        self.user = user or getpass.getuser()
         self.socket = None
         self.connected = False
         self.download_dir = 'downloads'
+        self.watch_socket = None
+        
+        # Transfer events (progress, throughput, ETA) for the GUI, scripts and tests
+        self.events = TransferEventBus()
         
         # Create download directory if it doesn't exist
         if not os.path.exists(self.download_dir):
             os.makedirs(self.download_dir)
         
+        # Content-addressed copies of past downloads, used for conditional downloads
+        self.content_cache = ContentCache(os.path.join(self.download_dir, '.cache'))
+        
         logging.info(f"Client initialized to connect to {host}:{port}")
     
     def connect(self):
@@ -43,6 +152,7 @@ class FileClient:
     
     def disconnect(self):
         """Disconnect from the server"""
+        self.stop_watch()
         if self.socket:
             self.socket.close()
             self.socket = None
@@ -57,12 +167,11 @@ class FileClient:
         
         try:
             # Send LIST command
-            command = {'command': 'LIST'}
+            command = {'command': 'LIST', 'framed': True}
             self.socket.send(json.dumps(command).encode('utf-8'))
             
             # Receive response
-            response_data = self.socket.recv(8192)  # Larger buffer for file lists
-            response = json.loads(response_data.decode('utf-8'))
+            response = self.receive_json()
             
             if response.get('status') == 'success':
                 logging.info("Received file list from server")
@@ -76,8 +185,180 @@ class FileClient:
             self.disconnect()
             return None
     
-    def upload_file(self, file_path, progress_callback=None):
-        """Upload a file to the server"""
+    def search_files(self, **criteria):
+        """Search files on the server without pulling the full listing.
+        
+        Supported criteria: prefix, contains, glob, extension, min_size,
+        max_size, modified_after, modified_before, sort_by ('name', 'size'
+        or 'modified'), descending and limit. Returns (files, total) where
+        total counts every match, or (None, 0) on failure.
+        """
+        if not self.connected:
+            logging.error("Not connected to server")
+            return None, 0
+        
+        try:
+            # Send SEARCH command
+            command = {'command': 'SEARCH', 'framed': True}
+            command.update({key: value for key, value in criteria.items() if value is not None})
+            self.socket.send(json.dumps(command).encode('utf-8'))
+            
+            # Receive response
+            response = self.receive_json()
+            
+            if response.get('status') == 'success':
+                logging.info(f"Received {len(response.get('files', []))} search results from server")
+                return response.get('files', []), response.get('total', 0)
+            else:
+                logging.error(f"Error searching files: {response.get('message')}")
+                return None, 0
+        
+        except Exception as e:
+            logging.error(f"Error in search_files: {e}")
+            self.disconnect()
+            return None, 0
+    
+    def get_stats(self):
+        """Request live throughput, latency and error counters from the server"""
+        if not self.connected:
+            logging.error("Not connected to server")
+            return None
+        
+        try:
+            command = {'command': 'STATS', 'framed': True}
+            self.socket.send(json.dumps(command).encode('utf-8'))
+            response = self.receive_json()
+            
+            if response.get('status') == 'success':
+                return response.get('stats', {})
+            else:
+                logging.error(f"Error getting stats: {response.get('message')}")
+                return None
+        
+        except Exception as e:
+            logging.error(f"Error in get_stats: {e}")
+            self.disconnect()
+            return None
+    
+    def get_usage(self):
+        """Request this user's storage usage and quota from the server"""
+        if not self.connected:
+            logging.error("Not connected to server")
+            return None
+        
+        try:
+            command = {'command': 'USAGE', 'user': self.user, 'framed': True}
+            self.socket.send(json.dumps(command).encode('utf-8'))
+            response = self.receive_json()
+            
+            if response.get('status') == 'success':
+                return response
+            else:
+                logging.error(f"Error getting usage: {response.get('message')}")
+                return None
+        
+        except Exception as e:
+            logging.error(f"Error in get_usage: {e}")
+            self.disconnect()
+            return None
+    
+    def receive_json(self):
+        """Receive a framed JSON response: a length line, then that many bytes"""
+        length_line = b''
+        while not length_line.endswith(b'\n'):
+            byte = self.socket.recv(1)
+            if not byte:
+                raise ConnectionError("Connection closed by server")
+            length_line += byte
+        
+        remaining = int(length_line)
+        data = bytearray()
+        while remaining > 0:
+            chunk = self.socket.recv(min(remaining, 1024 * 1024))
+            if not chunk:
+                raise ConnectionError("Connection closed by server")
+            data += chunk
+            remaining -= len(chunk)
+        return json.loads(data.decode('utf-8'))
+    
+    def start_watch(self, event_callback, closed_callback=None):
+        """Subscribe to change events pushed by the server.
+        
+        Events arrive on a separate connection so they never interleave with
+        command responses. event_callback is called from a background thread
+        with a list of events, each a dict with 'event' (added, removed or
+        modified), 'name' and, unless removed, 'size' and 'modified'.
+        closed_callback, if given, is called from that thread when the watch
+        ends without stop_watch, e.g. because the server dropped it.
+        """
+        if not self.connected:
+            logging.error("Not connected to server")
+            return False
+        
+        try:
+            self.watch_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.watch_socket.connect((self.host, self.port))
+            command = {'command': 'WATCH'}
+            self.watch_socket.sendall(json.dumps(command).encode('utf-8'))
+            
+            # Events are newline-delimited JSON messages
+            watch_stream = self.watch_socket.makefile('rb')
+            response = json.loads(watch_stream.readline().decode('utf-8'))
+            if response.get('status') != 'success':
+                logging.error(f"Error starting watch: {response.get('message')}")
+                self.stop_watch()
+                return False
+            
+            threading.Thread(
+                target=self.watch_loop,
+                args=(self.watch_socket, watch_stream, event_callback, closed_callback),
+                daemon=True
+            ).start()
+            logging.info("Watching server for changes")
+            return True
+        
+        except Exception as e:
+            logging.error(f"Error in start_watch: {e}")
+            self.stop_watch()
+            return False
+    
+    def watch_loop(self, watch_socket, watch_stream, event_callback, closed_callback=None):
+        """Receive pushed change events until the watch is stopped"""
+        try:
+            for line in watch_stream:
+                message = json.loads(line.decode('utf-8'))
+                if message.get('status') == 'event':
+                    event_callback(message.get('events', []))
+        except Exception as e:
+            if self.watch_socket is watch_socket:
+                logging.error(f"Error in watch_loop: {e}")
+        finally:
+            watch_stream.close()
+            # stop_watch clears watch_socket first, so anything else is a lost watch
+            if self.watch_socket is watch_socket:
+                self.stop_watch()
+                logging.warning("Lost change event stream from server")
+                if closed_callback:
+                    closed_callback()
+    
+    def stop_watch(self):
+        """Stop receiving change events"""
+        if self.watch_socket:
+            watch_socket = self.watch_socket
+            self.watch_socket = None
+            try:
+                watch_socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            watch_socket.close()
+            logging.info("Stopped watching server for changes")
+    
+    def upload_file(self, file_path, progress_callback=None, overwrite=False):
+        """Upload a file to the server.
+        
+        With overwrite, an existing file of the same name is replaced
+        instead of the upload being stored as a new _vN version.
+        """
         if not self.connected:
             logging.error("Not connected to server")
             return False, "Not connected to server"
@@ -86,6 +367,7 @@ class FileClient:
             logging.error(f"File not found: {file_path}")
             return False, "File not found"
         
+        progress = None
         try:
             filename = os.path.basename(file_path)
             file_size = os.path.getsize(file_path)
@@ -102,7 +384,9 @@ class FileClient:
                 'command': 'UPLOAD',
                 'filename': filename,
                 'file_size': file_size,
-                'file_hash': file_hash
+                'file_hash': file_hash,
+                'user': self.user,
+                'overwrite': overwrite
             }
             self.socket.send(json.dumps(command).encode('utf-8'))
             
@@ -124,6 +408,7 @@ class FileClient:
                 response_data = self.socket.recv(1024)
                 response = json.loads(response_data.decode('utf-8'))
             # Server is ready, send file data
+            progress = TransferProgress(self.events, 'upload', filename, file_size, progress_callback)
             sent_size = 0
             with open(file_path, 'rb') as f:
                 while sent_size < file_size:
@@ -135,9 +420,7 @@ class FileClient:
                     sent_size += len(chunk)
                     
                     # Update progress
-                    if progress_callback:
-                        progress = (sent_size / file_size) * 100
-                        progress_callback(progress)
+                    progress.update(len(chunk))
             
             # Wait for final confirmation
             final_response_data = self.socket.recv(1024)
@@ -145,34 +428,57 @@ class FileClient:
             
             if final_response.get('status') == 'success':
                 logging.info(f"File {filename} uploaded successfully")
+                progress.finish(True, final_response.get('message', 'Upload successful'))
                 return True, final_response.get('message', 'Upload successful')
             else:
                 logging.error(f"Upload failed: {final_response.get('message')}")
+                progress.finish(False, final_response.get('message', 'Upload failed'))
                 return False, final_response.get('message', 'Upload failed')
                 
         except Exception as e:
             logging.error(f"Error in upload_file: {e}")
+            if progress:
+                progress.finish(False, str(e))
             self.disconnect()
             return False, str(e)
     
-    def download_file(self, filename, download_dir=None, progress_callback=None):
-        """Download a file from the server"""
+    def download_file(self, filename, download_dir=None, progress_callback=None, use_cache=True):
+        """Download a file from the server.
+        
+        With use_cache, the hash of a previously downloaded copy is sent
+        along; if the server still has the same content it skips the body
+        and the file is restored from the local content cache instead.
+        """
         if not self.connected:
             logging.error("Not connected to server")
             return False, "Not connected to server"
         
+        # Determine target directory
+        target_dir = download_dir if download_dir else self.download_dir
+        
+        progress = None
         try:
             # Send DOWNLOAD command
             command = {
                 'command': 'DOWNLOAD',
                 'filename': filename
             }
+            known_hash = self.content_cache.known_hash(filename) if use_cache else None
+            if known_hash:
+                command['known_hash'] = known_hash
             self.socket.send(json.dumps(command).encode('utf-8'))
             
             # Receive file info
             response_data = self.socket.recv(1024)
             response = json.loads(response_data.decode('utf-8'))
             
+            if response.get('status') == 'not_modified':
+                result = self.restore_from_cache(filename, known_hash, response.get('file_size'), target_dir, progress_callback)
+                if result is None:
+                    # The cached copy vanished since we asked; fetch the body after all
+                    return self.download_file(filename, download_dir, progress_callback, use_cache=False)
+                return result
+            
             if response.get('status') != 'ready':
                 logging.error(f"Server not ready: {response.get('message')}")
                 return False, response.get('message', 'File not found')
@@ -180,26 +486,23 @@ class FileClient:
             file_size = response.get('file_size')
             file_hash = response.get('file_hash')
             
+            # Same content cached under another name - decline the body
+            if use_cache and self.content_cache.contains(file_hash):
+                self.socket.send(json.dumps({'status': 'cached'}).encode('utf-8'))
+                result = self.restore_from_cache(filename, file_hash, file_size, target_dir, progress_callback)
+                if result is not None:
+                    return result
+                return self.download_file(filename, download_dir, progress_callback, use_cache=False)
+            
             # Send ready confirmation
             ready_response = {'status': 'ready'}
             self.socket.send(json.dumps(ready_response).encode('utf-8'))
             
-            # Determine target directory
-            target_dir = download_dir if download_dir else self.download_dir
-            
             # Prepare to receive file
-            target_path = os.path.join(target_dir, filename)
-            
-            # Check if file exists and handle duplicates
-            if os.path.exists(target_path):
-                name, ext = os.path.splitext(filename)
-                version = 1
-                while os.path.exists(target_path):
-                    new_filename = f"{name}_v{version}{ext}"
-                    target_path = os.path.join(target_dir, new_filename)
-                    version += 1
+            target_path = self.resolve_target_path(target_dir, filename)
             
             # Receive file data
+            progress = TransferProgress(self.events, 'download', filename, file_size, progress_callback)
             received_size = 0
             hash_obj = hashlib.sha256()
             
@@ -215,25 +518,63 @@ class FileClient:
                     received_size += len(chunk)
                     
                     # Update progress
-                    if progress_callback:
-                        progress = (received_size / file_size) * 100
-                        progress_callback(progress)
+                    progress.update(len(chunk))
             
             # Verify file integrity
             calculated_hash = hash_obj.hexdigest()
             if calculated_hash == file_hash:
                 logging.info(f"File {filename} downloaded successfully")
+                if use_cache:
+                    self.content_cache.add(filename, file_hash, target_path)
+                progress.finish(True, f"Downloaded to {target_path}")
                 return True, f"Downloaded to {target_path}"
             else:
                 logging.error(f"File integrity check failed for {filename}")
                 # Delete the corrupted file
                 os.remove(target_path)
+                progress.finish(False, "File integrity check failed")
                 return False, "File integrity check failed"
                 
         except Exception as e:
             logging.error(f"Error in download_file: {e}")
+            if progress:
+                progress.finish(False, str(e))
             self.disconnect()
             return False, str(e)
+    
+    def restore_from_cache(self, filename, file_hash, file_size, target_dir, progress_callback=None):
+        """Materialize a download from the content cache.
+        
+        Returns (success, message), or None if the cached copy is gone.
+        """
+        progress = TransferProgress(self.events, 'download', filename, file_size, progress_callback)
+        target_path = os.path.join(target_dir, filename)
+        if self.content_cache.is_materialized(file_hash, target_path):
+            message = f"Already up to date at {target_path}"
+        else:
+            target_path = self.resolve_target_path(target_dir, filename)
+            if not self.content_cache.materialize(file_hash, target_path):
+                return None
+            message = f"Downloaded to {target_path} from cache"
+        
+        progress.update(file_size)
+        progress.finish(True, message)
+        logging.info(f"File {filename} restored from content cache")
+        return True, message
+    
+    def resolve_target_path(self, target_dir, filename):
+        """Pick a download path, versioning the name if the file exists"""
+        target_path = os.path.join(target_dir, filename)
+        
+        # Check if file exists and handle duplicates
+        if os.path.exists(target_path):
+            name, ext = os.path.splitext(filename)
+            version = 1
+            while os.path.exists(target_path):
+                new_filename = f"{name}_v{version}{ext}"
+                target_path = os.path.join(target_dir, new_filename)
+                version += 1
+        return target_path
 
 class FileClientGUI:
     def __init__(self, root):
@@ -294,6 +635,11 @@ class FileClientGUI:
         port_entry = ttk.Entry(conn_frame, textvariable=self.port_var, width=10)
         port_entry.grid(row=0, column=3, padx=5, pady=5, sticky=tk.W)
         
+        ttk.Label(conn_frame, text="User:").grid(row=1, column=0, padx=5, pady=5, sticky=tk.W)
+        self.user_var = tk.StringVar(value=getpass.getuser())
+        user_entry = ttk.Entry(conn_frame, textvariable=self.user_var, width=20)
+        user_entry.grid(row=1, column=1, padx=5, pady=5, sticky=tk.W)
+        
         # Connection buttons
         self.connect_btn = ttk.Button(conn_frame, text="Connect", command=self.connect_to_server)
         self.connect_btn.grid(row=0, column=4, padx=5, pady=5)
@@ -325,6 +671,16 @@ class FileClientGUI:
         self.download_btn = ttk.Button(toolbar, text="Download", command=self.download_selected, state=tk.DISABLED)
         self.download_btn.pack(side=tk.LEFT, padx=5)
         
+        # Search box - names with *, ? or [ are matched as globs, others as substrings
+        self.search_btn = ttk.Button(toolbar, text="Search", command=self.search_files, state=tk.DISABLED)
+        self.search_btn.pack(side=tk.RIGHT, padx=5)
+        
+        self.search_var = tk.StringVar()
+        search_entry = ttk.Entry(toolbar, textvariable=self.search_var, width=30)
+        search_entry.pack(side=tk.RIGHT, padx=5)
+        search_entry.bind("<Return>", lambda event: self.search_files())
+        self.search_active = False
+        
         # File list with scrollbars
         list_frame = ttk.Frame(file_frame)
         list_frame.pack(fill=tk.BOTH, expand=True)
@@ -380,7 +736,10 @@ class FileClientGUI:
             return
         
         # Initialize client
-        self.client = FileClient(host, port)
+        self.client = FileClient(host, port, self.user_var.get().strip() or None)
+        self.client.events.subscribe(
+            lambda event: self.root.after(0, lambda: self.show_transfer_event(event))
+        )
         
         # Disable buttons during connection
         self.set_buttons_state(False)
@@ -419,6 +778,7 @@ class FileClientGUI:
             self.status_var.set("Connected to server")
             self.set_connected_state(True)
             self.refresh_file_list()
+            self.start_watch()
         else:
             self.status_var.set("Connection failed")
             messagebox.showerror("Connection Error", "Failed to connect to server. Make sure the server is running.")
@@ -438,12 +798,14 @@ class FileClientGUI:
             self.refresh_btn.config(state=tk.NORMAL)
             self.upload_btn.config(state=tk.NORMAL)
             self.download_btn.config(state=tk.NORMAL)
+            self.search_btn.config(state=tk.NORMAL)
         else:
             self.connect_btn.config(state=tk.NORMAL)
             self.disconnect_btn.config(state=tk.DISABLED)
             self.refresh_btn.config(state=tk.DISABLED)
             self.upload_btn.config(state=tk.DISABLED)
             self.download_btn.config(state=tk.DISABLED)
+            self.search_btn.config(state=tk.DISABLED)
     
     def set_buttons_state(self, enabled=True):
         """Enable or disable buttons during operations"""
@@ -453,6 +815,7 @@ class FileClientGUI:
         self.refresh_btn.config(state=state)
         self.upload_btn.config(state=state)
         self.download_btn.config(state=state)
+        self.search_btn.config(state=state)
     
     def refresh_file_list(self):
         """Refresh the file list from the server"""
@@ -462,6 +825,8 @@ class FileClientGUI:
         self.set_buttons_state(False)
         self.status_var.set("Refreshing file list...")
         
+        self.search_active = False
+        
         def refresh_thread():
             files = self.client.list_files()
             
@@ -470,6 +835,72 @@ class FileClientGUI:
         
         threading.Thread(target=refresh_thread, daemon=True).start()
     
+    def search_files(self):
+        """Search the server's files by name"""
+        if not self.client or not self.client.connected:
+            return
+        
+        query = self.search_var.get().strip()
+        if not query:
+            self.refresh_file_list()
+            return
+        
+        self.set_buttons_state(False)
+        self.status_var.set("Searching...")
+        
+        def search_thread():
+            if any(char in query for char in '*?['):
+                files, total = self.client.search_files(glob=query, limit=1000)
+            else:
+                files, total = self.client.search_files(contains=query, limit=1000)
+            
+            # Update UI in the main thread
+            self.root.after(0, lambda: self.update_search_results(files, total))
+        
+        threading.Thread(target=search_thread, daemon=True).start()
+    
+    def update_search_results(self, files, total):
+        """Show search results in the file list"""
+        self.update_file_list(files)
+        if files is not None:
+            self.search_active = True
+            self.status_var.set(f"Showing {len(files)} of {total} matching files")
+    
+    def start_watch(self):
+        """Subscribe to server change events instead of polling for them"""
+        def watch_thread():
+            self.client.start_watch(
+                lambda events: self.root.after(0, lambda: self.apply_file_events(events)),
+                lambda: self.root.after(0, self.watch_lost)
+            )
+        
+        threading.Thread(target=watch_thread, daemon=True).start()
+    
+    def watch_lost(self):
+        """Catch up on missed changes and subscribe again after the watch drops"""
+        if not self.client or not self.client.connected:
+            return
+        self.refresh_file_list()
+        self.start_watch()
+    
+    def apply_file_events(self, events):
+        """Apply pushed change events to the file list"""
+        if not self.client or not self.client.connected:
+            return
+        
+        for event in events:
+            name = event.get('name', '')
+            if event.get('event') == 'removed':
+                if self.file_tree.exists(name):
+                    self.file_tree.delete(name)
+                continue
+            
+            values = (name, self.format_size(event.get('size', 0)), event.get('modified', ''))
+            if self.file_tree.exists(name):
+                self.file_tree.item(name, values=values)
+            elif not self.search_active:
+                self.file_tree.insert('', tk.END, iid=name, values=values)
+    
     def update_file_list(self, files):
         """Update the file list with data from server"""
         self.clear_file_list()
@@ -516,17 +947,22 @@ class FileClientGUI:
         filename = os.path.basename(file_path)
         file_size = os.path.getsize(file_path)
         
+        # Replacing a file keeps only one copy counting against the quota
+        overwrite = False
+        if self.file_tree.exists(filename):
+            overwrite = messagebox.askyesno(
+                "File Exists",
+                f"{filename} already exists on the server. Overwrite it?\n\nChoose No to upload it as a new version."
+            )
+        
         # Disable buttons during upload
         self.set_buttons_state(False)
         self.transfer_status_var.set(f"Uploading {filename}...")
         self.progress_var.set(0)
         
-        # Upload in a separate thread
+        # Upload in a separate thread; progress arrives through the client's event bus
         def upload_thread():
-            def update_progress(progress):
-                self.progress_var.set(progress)
-            
-            success, message = self.client.upload_file(file_path, update_progress)
+            success, message = self.client.upload_file(file_path, overwrite=overwrite)
             
             # Update UI in the main thread
             self.root.after(0, lambda: self.upload_complete(success, message, filename))
@@ -538,7 +974,9 @@ class FileClientGUI:
         if success:
             self.status_var.set(f"Uploaded {filename} successfully")
             self.transfer_status_var.set(f"Upload complete: {filename}")
-            self.refresh_file_list()
+            # Watchers get the new file pushed; only poll if the watch is down
+            if not self.client.watch_socket:
+                self.refresh_file_list()
         else:
             self.status_var.set(f"Upload failed: {message}")
             self.transfer_status_var.set(f"Upload failed: {filename}")
@@ -568,12 +1006,9 @@ class FileClientGUI:
         self.transfer_status_var.set(f"Downloading {filename}...")
         self.progress_var.set(0)
         
-        # Download in a separate thread
+        # Download in a separate thread; progress arrives through the client's event bus
         def download_thread():
-            def update_progress(progress):
-                self.progress_var.set(progress)
-            
-            success, message = self.client.download_file(filename, download_dir, update_progress)
+            success, message = self.client.download_file(filename, download_dir)
             
             # Update UI in the main thread
             self.root.after(0, lambda: self.download_complete(success, message, filename))
@@ -593,6 +1028,21 @@ class FileClientGUI:
         
         self.set_buttons_state(True)
     
+    def show_transfer_event(self, event):
+        """Show transfer progress, throughput and ETA (runs on the Tk thread)"""
+        if event['type'] != 'progress':
+            if event['type'] == 'completed':
+                self.progress_var.set(100)
+            return
+        
+        self.progress_var.set(event['percent'])
+        action = "Uploading" if event['direction'] == 'upload' else "Downloading"
+        status = f"{action} {event['filename']}: {event['percent']:.1f}% at {self.format_size(event['avg_rate'])}/s"
+        if event['eta'] is not None:
+            minutes, seconds = divmod(int(event['eta']), 60)
+            status += f", {minutes}:{seconds:02d} left"
+        self.transfer_status_var.set(status)
+    
     def format_size(self, size_bytes):
         """Format file size to human-readable format"""
         if size_bytes == 0:
@@ -0,0 +1,158 @@
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+class ContentCache:
+    """Client-side content-addressed store of downloaded files.
+
+    Blobs are stored under their SHA-256 and remembered per server
+    filename, so a download can tell the server which version it already
+    has. Downloads enter the store by hardlink where possible, but files
+    are materialized from it as copies, so editing one copy never changes
+    another. The least recently used blobs are evicted once the store
+    grows past max_bytes.
+    """
+
+    def __init__(self, cache_dir, max_bytes=1024 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(cache_dir, 'index.json')
+        self.lock = threading.Lock()
+
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+        # blobs: hash -> {'size', 'mtime_ns', 'last_used'}; names: filename -> hash;
+        # copies: path -> {'hash', 'size', 'mtime_ns'} for files handed out from the store
+        self.blobs = {}
+        self.names = {}
+        self.copies = {}
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path) as f:
+                    index = json.load(f)
+                self.blobs = index.get('blobs', {})
+                self.names = index.get('names', {})
+                self.copies = index.get('copies', {})
+            except (OSError, ValueError) as e:
+                logging.error(f"Ignoring unreadable content cache index: {e}")
+
+    def blob_path(self, file_hash):
+        return os.path.join(self.cache_dir, file_hash[:2], file_hash)
+
+    def known_hash(self, filename):
+        """Return the hash of the cached copy of filename, if still valid"""
+        with self.lock:
+            file_hash = self.names.get(filename)
+            if file_hash is None or not self.valid_locked(file_hash):
+                return None
+            return file_hash
+
+    def contains(self, file_hash):
+        """Check whether a blob with this hash is cached and unchanged"""
+        with self.lock:
+            return self.valid_locked(file_hash)
+
+    def add(self, filename, file_hash, source_path):
+        """Store a verified download under its hash and remember its name"""
+        with self.lock:
+            if not self.valid_locked(file_hash):
+                blob_path = self.blob_path(file_hash)
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                if os.path.exists(blob_path):
+                    os.remove(blob_path)
+                self.link_or_copy(source_path, blob_path)
+                blob_stat = os.stat(blob_path)
+                self.blobs[file_hash] = {
+                    'size': blob_stat.st_size,
+                    'mtime_ns': blob_stat.st_mtime_ns,
+                    'last_used': time.time()
+                }
+            self.names[filename] = file_hash
+            self.record_copy_locked(file_hash, source_path)
+            self.evict_locked()
+            self.save_locked()
+
+    def materialize(self, file_hash, target_path):
+        """Create target_path from the cached blob; returns False if it is gone"""
+        with self.lock:
+            if not self.valid_locked(file_hash):
+                return False
+            shutil.copyfile(self.blob_path(file_hash), target_path)
+            self.record_copy_locked(file_hash, target_path)
+            self.blobs[file_hash]['last_used'] = time.time()
+            self.save_locked()
+            return True
+
+    def is_materialized(self, file_hash, target_path):
+        """Check whether target_path is an unmodified copy of the cached blob"""
+        with self.lock:
+            if not self.valid_locked(file_hash):
+                return False
+            entry = self.copies.get(os.path.abspath(target_path))
+            if entry is None or entry['hash'] != file_hash:
+                return False
+            try:
+                target_stat = os.stat(target_path)
+            except OSError:
+                target_stat = None
+            if target_stat is None or target_stat.st_size != entry['size'] or target_stat.st_mtime_ns != entry['mtime_ns']:
+                del self.copies[os.path.abspath(target_path)]
+                return False
+            return True
+    
+    def record_copy_locked(self, file_hash, path):
+        path_stat = os.stat(path)
+        self.copies[os.path.abspath(path)] = {
+            'hash': file_hash,
+            'size': path_stat.st_size,
+            'mtime_ns': path_stat.st_mtime_ns
+        }
+
+    def valid_locked(self, file_hash):
+        # The download a blob was linked from can be edited in place, so check it
+        entry = self.blobs.get(file_hash)
+        if entry is None:
+            return False
+        try:
+            blob_stat = os.stat(self.blob_path(file_hash))
+        except OSError:
+            blob_stat = None
+        if blob_stat is None or blob_stat.st_size != entry['size'] or blob_stat.st_mtime_ns != entry['mtime_ns']:
+            self.drop_locked(file_hash)
+            return False
+        return True
+
+    def evict_locked(self):
+        total = sum(entry['size'] for entry in self.blobs.values())
+        for file_hash, entry in sorted(self.blobs.items(), key=lambda item: item[1]['last_used']):
+            if total <= self.max_bytes:
+                break
+            total -= entry['size']
+            self.drop_locked(file_hash)
+            logging.info(f"Evicted {file_hash} from content cache")
+
+    def drop_locked(self, file_hash):
+        self.blobs.pop(file_hash, None)
+        self.names = {name: value for name, value in self.names.items() if value != file_hash}
+        self.copies = {path: entry for path, entry in self.copies.items() if entry['hash'] != file_hash}
+        try:
+            os.remove(self.blob_path(file_hash))
+        except OSError:
+            pass
+
+    def save_locked(self):
+        temp_path = self.index_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump({'blobs': self.blobs, 'names': self.names, 'copies': self.copies}, f)
+        os.replace(temp_path, self.index_path)
+
+    @staticmethod
+    def link_or_copy(source_path, target_path):
+        try:
+            os.link(source_path, target_path)
+        except OSError:
+            shutil.copy2(source_path, target_path)
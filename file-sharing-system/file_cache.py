@@ -0,0 +1,80 @@
+import threading
+from collections import OrderedDict
+
+class FileCache:
+    """Size-bounded LRU cache of download headers and small file bodies.
+
+    Every entry is tagged with the file's version (size and mtime) so a
+    changed file is never served stale. Bodies are kept only for files up
+    to max_entry_size; larger files just cache their hash so downloads
+    skip the hashing pass.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_entry_size=1024 * 1024, max_entries=100000):
+        self.max_bytes = max_bytes
+        self.max_entry_size = max_entry_size
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, filename, version):
+        """Return (file_size, file_hash, body) for a cached file, or None.
+
+        body is None when only the header of a large file is cached.
+        """
+        with self.lock:
+            entry = self.entries.get(filename)
+            if entry is None or entry[0] != version:
+                if entry is not None:
+                    self.drop_locked(filename)
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(filename)
+            self.hits += 1
+            return entry[1:]
+
+    def put(self, filename, version, file_size, file_hash, body=None):
+        """Cache a file's header, and its body if it is small enough"""
+        if body is not None and len(body) > self.max_entry_size:
+            body = None
+
+        with self.lock:
+            if filename in self.entries:
+                self.drop_locked(filename)
+            self.entries[filename] = (version, file_size, file_hash, body)
+            if body is not None:
+                self.current_bytes += len(body)
+
+            # Evict least recently used entries until within bounds
+            while self.entries and (self.current_bytes > self.max_bytes or len(self.entries) > self.max_entries):
+                oldest = next(iter(self.entries))
+                self.drop_locked(oldest)
+                self.evictions += 1
+
+    def invalidate(self, filename):
+        """Forget a file, e.g. after it has been uploaded again"""
+        with self.lock:
+            if filename in self.entries:
+                self.drop_locked(filename)
+
+    def drop_locked(self, filename):
+        body = self.entries.pop(filename)[3]
+        if body is not None:
+            self.current_bytes -= len(body)
+
+    def stats(self):
+        """Return hit, miss and eviction counters and current usage"""
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes
+            }
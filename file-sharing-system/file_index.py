@@ -0,0 +1,420 @@
+import bisect
+import fnmatch
+import heapq
+import os
+import threading
+from array import array
+from collections import defaultdict
+from datetime import datetime
+
+GLOB_CHARS = '*?['
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+class FileIndex:
+    """In-memory index over file metadata used by the SEARCH command.
+
+    Names are kept sorted for prefix and glob lookups, sizes and modified
+    times are kept in sorted lists for range lookups, and names are
+    bucketed by extension. Substrings and inner glob literals use a
+    trigram index: each name gets an integer id, and each trigram maps to
+    an array of the ids whose names contain it. A query starts from the
+    smallest candidate set its criteria allow. When that index answers every criterion, the
+    total comes from its count and the page is read off a sorted list,
+    so the query does not touch each match.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.records = {}
+        self.sorted_names = []
+        self.sorted_sizes = []
+        self.sorted_mtimes = []
+        # Exact-case extension -> names, and lowercase extension -> exact cases seen
+        self.by_extension = {}
+        self.extension_cases = {}
+        # Removed names leave dead ids in the trigram arrays until they are rebuilt
+        self.name_ids = {}
+        self.names_by_id = []
+        self.by_trigram = {}
+        self.dead_ids = 0
+
+    def build(self, storage_dir, extra_records=()):
+        """Index every file in storage_dir plus (name, size, mtime) extra_records"""
+        with self.lock:
+            self.records = {}
+            self.by_extension = {}
+            self.extension_cases = {}
+            for entry in os.scandir(storage_dir):
+                if entry.is_file():
+                    stat = entry.stat()
+                    self.records[entry.name] = (stat.st_size, stat.st_mtime)
+            for name, size, mtime in extra_records:
+                self.records[name] = (size, mtime)
+            for name in self.records:
+                self.add_extension_locked(name)
+            self.rebuild_trigrams_locked()
+
+            self.sorted_names = sorted(self.records)
+            self.sorted_sizes = sorted((size, name) for name, (size, _) in self.records.items())
+            self.sorted_mtimes = sorted((mtime, name) for name, (_, mtime) in self.records.items())
+
+    def add(self, name, size, mtime):
+        """Add or update a file in the index"""
+        with self.lock:
+            if name in self.records:
+                self.remove_locked(name)
+            self.records[name] = (size, mtime)
+            bisect.insort(self.sorted_names, name)
+            bisect.insort(self.sorted_sizes, (size, name))
+            bisect.insort(self.sorted_mtimes, (mtime, name))
+            self.add_extension_locked(name)
+            self.add_trigrams_locked(name)
+
+    def add_extension_locked(self, name):
+        suffix = os.path.splitext(name)[1]
+        self.by_extension.setdefault(suffix, set()).add(name)
+        self.extension_cases.setdefault(suffix.lower(), set()).add(suffix)
+
+    def add_trigrams_locked(self, name):
+        name_id = len(self.names_by_id)
+        self.names_by_id.append(name)
+        self.name_ids[name] = name_id
+        for trigram in self.trigrams(name):
+            ids = self.by_trigram.get(trigram)
+            if ids is None:
+                ids = self.by_trigram[trigram] = array('I')
+            ids.append(name_id)
+
+    def rebuild_trigrams_locked(self):
+        self.names_by_id = list(self.records)
+        self.name_ids = {name: name_id for name_id, name in enumerate(self.names_by_id)}
+        by_trigram = defaultdict(lambda: array('I'))
+        self.dead_ids = 0
+        for name_id, name in enumerate(self.names_by_id):
+            for trigram in {name[i:i + 3] for i in range(len(name) - 2)}:
+                by_trigram[trigram].append(name_id)
+        self.by_trigram = dict(by_trigram)
+
+    def list_entries(self):
+        """Return [(name, size, mtime)] for every indexed file"""
+        with self.lock:
+            return [(name, size, mtime) for name, (size, mtime) in self.records.items()]
+
+    def get(self, name):
+        """Return (size, mtime) for an indexed file, or None"""
+        with self.lock:
+            return self.records.get(name)
+
+    def remove(self, name):
+        """Remove a file from the index"""
+        with self.lock:
+            if name in self.records:
+                self.remove_locked(name)
+
+    def remove_locked(self, name):
+        size, mtime = self.records.pop(name)
+        self.delete_sorted(self.sorted_names, name)
+        self.delete_sorted(self.sorted_sizes, (size, name))
+        self.delete_sorted(self.sorted_mtimes, (mtime, name))
+        suffix = os.path.splitext(name)[1]
+        names = self.by_extension.get(suffix)
+        if names is not None:
+            names.discard(name)
+            if not names:
+                del self.by_extension[suffix]
+                cases = self.extension_cases[suffix.lower()]
+                cases.discard(suffix)
+                if not cases:
+                    del self.extension_cases[suffix.lower()]
+        self.names_by_id[self.name_ids.pop(name)] = None
+        self.dead_ids += 1
+        if self.dead_ids > len(self.name_ids) + 1000:
+            self.rebuild_trigrams_locked()
+
+    def search(self, prefix=None, contains=None, glob=None, extension=None,
+               min_size=None, max_size=None, modified_after=None, modified_before=None,
+               sort_by='name', descending=False, limit=100):
+        """Find files matching every given criterion.
+
+        Returns (total, files) where total is the number of matches and files
+        holds at most limit of them, sorted by name, size or modified.
+        """
+        if sort_by not in ('name', 'size', 'modified'):
+            raise ValueError(f"Cannot sort by '{sort_by}'")
+        if extension is not None:
+            extension = extension.lower()
+            if extension and not extension.startswith('.'):
+                extension = '.' + extension
+        modified_after = self.parse_time(modified_after)
+        modified_before = self.parse_time(modified_before)
+
+        required = {
+            criterion for criterion, given in (
+                ('prefix', prefix is not None),
+                ('contains', contains is not None),
+                ('glob', glob is not None),
+                ('extension', extension is not None),
+                ('size', min_size is not None or max_size is not None),
+                ('modified', modified_after is not None or modified_before is not None))
+            if given
+        }
+
+        with self.lock:
+            count, covered, bounds, contains_name, fetch = self.candidates(
+                prefix, contains, glob, extension, min_size, max_size, modified_after, modified_before)
+            if covered >= required:
+                # Every candidate matches, so only the requested page is read
+                selected = self.select_locked(count, bounds, contains_name, sort_by, descending, limit)
+                if selected is not None:
+                    return count, self.format_matches(selected)
+            candidates = fetch()
+            records = self.records
+
+        # Filter a snapshot outside the lock so uploads are not held up
+        if 'prefix' in covered:
+            prefix = None
+        if 'glob' in covered:
+            glob = None
+        if 'extension' in covered:
+            extension = None
+        if 'size' in covered:
+            min_size = max_size = None
+        if 'modified' in covered:
+            modified_after = modified_before = None
+
+        matches = []
+        for name in candidates:
+            record = records.get(name)
+            if record is None:
+                continue
+            size, mtime = record
+            if prefix is not None and not name.startswith(prefix):
+                continue
+            if contains is not None and contains not in name:
+                continue
+            if glob is not None and not fnmatch.fnmatchcase(name, glob):
+                continue
+            if extension is not None and self.extension_of(name) != extension:
+                continue
+            if min_size is not None and size < min_size:
+                continue
+            if max_size is not None and size > max_size:
+                continue
+            if modified_after is not None and mtime < modified_after:
+                continue
+            if modified_before is not None and mtime > modified_before:
+                continue
+            matches.append((name, size, mtime))
+
+        sort_key = {
+            'name': lambda match: match[0],
+            'size': lambda match: (match[1], match[0]),
+            'modified': lambda match: (match[2], match[0]),
+        }[sort_by]
+        if limit is not None and limit < len(matches):
+            select = heapq.nlargest if descending else heapq.nsmallest
+            selected = select(limit, matches, key=sort_key)
+        else:
+            selected = sorted(matches, key=sort_key, reverse=descending)
+        return len(matches), self.format_matches(selected)
+
+    def candidates(self, prefix, contains, glob, extension, min_size, max_size,
+                   modified_after, modified_before):
+        """Pick the smallest candidate set the indexed criteria narrow down to.
+
+        Returns (count, covered, bounds, contains, fetch): covered names the
+        criteria every candidate is known to meet, bounds maps a sort key to
+        the (lo, hi) range the candidates fill in that sorted list, contains
+        tests whether a name is a candidate, and fetch returns them all.
+        """
+        total = len(self.records)
+        everything = {key: (0, total) for key in ('name', 'size', 'modified')}
+        options = [(total, set(), everything, lambda name: True, lambda: list(self.records))]
+
+        # Globs without a leading wildcard can use their literal prefix
+        literal = None
+        if glob is not None:
+            literal = glob
+            for char in GLOB_CHARS:
+                literal = literal.split(char, 1)[0]
+        name_prefix = prefix
+        if literal and (prefix is None or len(literal) > len(prefix)):
+            name_prefix = literal
+        if name_prefix is not None:
+            covered = set()
+            if prefix is None or name_prefix.startswith(prefix):
+                covered.add('prefix')
+            if name_prefix == literal and glob == f'{literal}*':
+                covered.add('glob')
+            options.append(self.prefix_option(name_prefix, covered))
+
+        # Substrings every match must contain narrow the names to one trigram's ids
+        literals = [contains] if contains is not None else []
+        if glob is not None:
+            literals.extend(self.glob_literals(glob))
+        trigrams = {trigram for literal in literals for trigram in self.trigrams(literal)}
+        if trigrams:
+            options.append(self.trigram_option(trigrams, literals))
+
+        if extension is not None:
+            buckets = [self.by_extension[suffix] for suffix in self.extension_cases.get(extension, ())]
+            options.append(self.bucket_option(buckets, {'extension'}))
+
+        # '*.ext' globs are an exact-case extension bucket, plus dotfiles such
+        # as '.ext' that splitext does not give an extension. For '*.tar.gz'
+        # the '.gz' bucket still narrows the names the glob is checked against
+        if glob is not None and glob.startswith('*'):
+            suffix = glob[1:]
+            if suffix.startswith('.') and not any(char in suffix for char in GLOB_CHARS):
+                last_suffix = suffix[suffix.rfind('.'):]
+                if suffix == last_suffix:
+                    dot_lo = bisect.bisect_left(self.sorted_names, '.')
+                    dot_hi = bisect.bisect_left(self.sorted_names, '/')
+                    dotfiles = {
+                        name for name in self.sorted_names[dot_lo:dot_hi]
+                        if name.endswith(suffix) and os.path.splitext(name)[1] != suffix
+                    }
+                    options.append(self.bucket_option([self.by_extension.get(suffix), dotfiles], {'glob'}))
+                else:
+                    options.append(self.bucket_option([self.by_extension.get(last_suffix)], set()))
+
+        if min_size is not None or max_size is not None:
+            options.append(self.range_option(self.sorted_sizes, 'size', min_size, max_size))
+
+        if modified_after is not None or modified_before is not None:
+            options.append(self.range_option(self.sorted_mtimes, 'modified', modified_after, modified_before))
+
+        # On a tie, prefer the option that leaves fewer criteria to filter
+        return min(options, key=lambda option: (option[0], -len(option[1])))
+
+    def prefix_option(self, name_prefix, covered):
+        lo = bisect.bisect_left(self.sorted_names, name_prefix)
+        hi = bisect.bisect_left(self.sorted_names, name_prefix + '\U0010ffff')
+        return (hi - lo, covered, {'name': (lo, hi)},
+                lambda name: name.startswith(name_prefix),
+                lambda: self.sorted_names[lo:hi])
+
+    def trigram_option(self, trigrams, literals):
+        ids = min((self.by_trigram.get(trigram, ()) for trigram in trigrams), key=len)
+        names_by_id = self.names_by_id
+        return (len(ids), set(), {},
+                lambda name: all(literal in name for literal in literals),
+                lambda: [name for name in map(names_by_id.__getitem__, ids) if name is not None])
+
+    @staticmethod
+    def bucket_option(buckets, covered):
+        buckets = [names for names in buckets if names]
+        return (sum(len(names) for names in buckets), covered, {},
+                lambda name: any(name in names for names in buckets),
+                lambda: [name for names in buckets for name in names])
+
+    def range_option(self, sorted_values, key, low, high):
+        lo = 0 if low is None else bisect.bisect_left(sorted_values, (low,))
+        hi = len(sorted_values) if high is None else bisect.bisect_right(sorted_values, (high, '\U0010ffff'))
+        hi = max(hi, lo)
+        position = 0 if key == 'size' else 1
+
+        def in_range(name):
+            value = self.records[name][position]
+            return (low is None or value >= low) and (high is None or value <= high)
+
+        return hi - lo, {key}, {key: (lo, hi)}, in_range, lambda: [name for _, name in sorted_values[lo:hi]]
+
+    def select_locked(self, count, bounds, contains, sort_by, descending, limit):
+        """Read one page of candidates off the sorted list for sort_by.
+
+        Candidates that fill a range of that list are sliced directly.
+        Otherwise the list is walked in order until limit candidates are
+        found, when that is expected to take fewer steps than visiting
+        every candidate. Returns None to fall back to filtering.
+        """
+        sorted_values = {'name': self.sorted_names, 'size': self.sorted_sizes,
+                         'modified': self.sorted_mtimes}[sort_by]
+        if sort_by in bounds:
+            lo, hi = bounds[sort_by]
+            if limit is not None and limit < hi - lo:
+                lo, hi = (hi - limit, hi) if descending else (lo, lo + limit)
+            entries = sorted_values[lo:hi]
+            if descending:
+                entries.reverse()
+        elif limit is not None and limit * len(sorted_values) <= count * count:
+            entries = []
+            if limit > 0:
+                walk = reversed(sorted_values) if descending else iter(sorted_values)
+                for entry in walk:
+                    if contains(entry if sort_by == 'name' else entry[1]):
+                        entries.append(entry)
+                        if len(entries) == limit:
+                            break
+        else:
+            return None
+
+        matches = []
+        for entry in entries:
+            name = entry if sort_by == 'name' else entry[1]
+            size, mtime = self.records[name]
+            matches.append((name, size, mtime))
+        return matches
+
+    @staticmethod
+    def format_matches(matches):
+        return [
+            {
+                'name': name,
+                'size': size,
+                'modified': datetime.fromtimestamp(mtime).strftime(TIME_FORMAT)
+            }
+            for name, size, mtime in matches
+        ]
+
+    @staticmethod
+    def delete_sorted(sorted_list, value):
+        position = bisect.bisect_left(sorted_list, value)
+        if position < len(sorted_list) and sorted_list[position] == value:
+            del sorted_list[position]
+
+    @staticmethod
+    def trigrams(text):
+        return {text[i:i + 3] for i in range(len(text) - 2)}
+
+    @staticmethod
+    def glob_literals(glob):
+        """Return the literal runs of a glob, which every match contains"""
+        literals = []
+        current = ''
+        i = 0
+        while i < len(glob):
+            char = glob[i]
+            if char in '*?':
+                literals.append(current)
+                current = ''
+            elif char == '[':
+                # Same bracket rules as fnmatch; an unclosed '[' is literal
+                end = i + 1
+                if glob[end:end + 1] == '!':
+                    end += 1
+                if glob[end:end + 1] == ']':
+                    end += 1
+                end = glob.find(']', end)
+                if end < 0:
+                    current += char
+                else:
+                    literals.append(current)
+                    current = ''
+                    i = end
+            else:
+                current += char
+            i += 1
+        literals.append(current)
+        return [literal for literal in literals if literal]
+
+    @staticmethod
+    def extension_of(name):
+        return os.path.splitext(name)[1].lower()
+
+    @staticmethod
+    def parse_time(value):
+        """Accept timestamps or 'YYYY-MM-DD HH:MM:SS' strings"""
+        if value is None or isinstance(value, (int, float)):
+            return value
+        return datetime.strptime(value, TIME_FORMAT).timestamp()
@@ -0,0 +1,358 @@
+import argparse
+import json
+import math
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from benchmark import parse_size, start_test_server, write_test_file
+
+LOG_LINE = re.compile(r'^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3}) - \w+ - (.*)$')
+# Server and client log messages that mark a completed command
+LOG_OPERATIONS = [
+    (re.compile(r'^Sent file list to client$'), 'LIST'),
+    (re.compile(r'^Received file list from server$'), 'LIST'),
+    (re.compile(r'^File (.+) uploaded successfully$'), 'UPLOAD'),
+    (re.compile(r'^File (.+) downloaded by client$'), 'DOWNLOAD'),
+    (re.compile(r'^File (.+) downloaded successfully$'), 'DOWNLOAD'),
+]
+
+def parse_weights(text, parse_key=str):
+    """Turn 'list=60,upload=20' or '1KB:70,1MB:30' into {key: weight}"""
+    weights = {}
+    for part in text.split(','):
+        key, weight = re.split(r'[=:]', part.strip(), maxsplit=1)
+        weights[parse_key(key.strip())] = float(weight)
+    return weights
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = max(math.ceil(q * len(sorted_values)) - 1, 0)
+    return sorted_values[index]
+
+class LoadStats:
+    """Collects per-operation latencies, outcomes and bytes from all sessions"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = []
+        self.start_time = time.perf_counter()
+        self.end_time = None
+
+    def record(self, operation, latency, success, size=0):
+        with self.lock:
+            self.samples.append((operation, latency, success, size))
+
+    def report(self):
+        """Summarize throughput, latency percentiles and error rates"""
+        elapsed = (self.end_time or time.perf_counter()) - self.start_time
+        with self.lock:
+            samples = list(self.samples)
+
+        report = {'elapsed_s': elapsed, 'operations': {}}
+        for operation in sorted({sample[0] for sample in samples}) + ['ALL']:
+            # Connection setup is reported on its own, not as a command
+            if operation == 'ALL':
+                selected = [sample for sample in samples if sample[0] != 'CONNECT']
+            else:
+                selected = [sample for sample in samples if sample[0] == operation]
+            latencies = sorted(sample[1] for sample in selected)
+            errors = sum(1 for sample in selected if not sample[2])
+            transferred = sum(sample[3] for sample in selected if sample[2])
+            report['operations'][operation] = {
+                'count': len(selected),
+                'errors': errors,
+                'error_rate': errors / len(selected) if selected else 0.0,
+                'ops_per_s': len(selected) / elapsed if elapsed > 0 else 0.0,
+                'mb_per_s': transferred / elapsed / (1024 * 1024) if elapsed > 0 else 0.0,
+                'p50_ms': percentile(latencies, 0.50) * 1000,
+                'p99_ms': percentile(latencies, 0.99) * 1000,
+                'p999_ms': percentile(latencies, 0.999) * 1000,
+                'max_ms': (latencies[-1] if latencies else 0.0) * 1000
+            }
+        return report
+
+class Session:
+    """One simulated client connection issuing commands"""
+
+    def __init__(self, host, port, workdir, stats):
+        from client import FileClient
+
+        self.client = FileClient(host, port)
+        self.workdir = workdir
+        self.download_dir = tempfile.mkdtemp(prefix='session-', dir=workdir)
+        self.upload_dir = None
+        self.stats = stats
+
+    def connect(self):
+        start = time.perf_counter()
+        success = self.client.connect()
+        self.stats.record('CONNECT', time.perf_counter() - start, success)
+        return success
+
+    def link_sources(self, sources, prefix):
+        """Give this session its own upload name for each source file.
+
+        Uploads land under the file's own name, so sessions sharing one
+        source would race on the same server path.
+        """
+        self.upload_dir = tempfile.mkdtemp(prefix='uploads-', dir=self.workdir)
+        linked = {}
+        for size, path in sources.items():
+            linked[size] = os.path.join(self.upload_dir, f'{prefix}_{size}.bin')
+            try:
+                os.link(path, linked[size])
+            except OSError:
+                shutil.copyfile(path, linked[size])
+        return linked
+
+    def run(self, operation, filename=None, source_path=None, size=0, overwrite=False, scheduled=None):
+        """Issue one command and record its latency and outcome.
+
+        With scheduled (a perf_counter time), latency is measured from then,
+        so time spent waiting for a free session counts against the server.
+        """
+        if not self.client.connected and not self.connect():
+            self.stats.record(operation, 0.0, False)
+            return
+
+        start = time.perf_counter() if scheduled is None else scheduled
+        if operation == 'LIST':
+            success = self.client.list_files() is not None
+        elif operation == 'UPLOAD':
+            success, _ = self.client.upload_file(source_path, overwrite=overwrite)
+        else:
+            success, _ = self.client.download_file(filename, self.download_dir, use_cache=False)
+            for name in os.listdir(self.download_dir):
+                os.remove(os.path.join(self.download_dir, name))
+        self.stats.record(operation, time.perf_counter() - start, success, size)
+
+    def close(self):
+        self.client.disconnect()
+        shutil.rmtree(self.download_dir, ignore_errors=True)
+        if self.upload_dir:
+            shutil.rmtree(self.upload_dir, ignore_errors=True)
+
+def prepare_sources(workdir, sizes):
+    """Create one upload source file per size"""
+    source_dir = os.path.join(workdir, 'sources')
+    os.makedirs(source_dir, exist_ok=True)
+    sources = {}
+    for size in sizes:
+        path = os.path.join(source_dir, f'load_{size}.bin')
+        write_test_file(path, size)
+        sources[size] = path
+    return sources
+
+def seed_server(host, port, workdir, sources):
+    """Upload one file per size so DOWNLOAD has something to fetch"""
+    stats = LoadStats()
+    session = Session(host, port, workdir, stats)
+    names = {}
+    try:
+        for size, path in sources.items():
+            session.run('UPLOAD', source_path=path, size=size)
+            names[size] = os.path.basename(path)
+    finally:
+        session.close()
+    if not all(sample[2] for sample in stats.samples):
+        raise RuntimeError("Could not seed the server with download files")
+    return names
+
+def run_mix(host, port, workdir, clients, duration, mix, size_weights, think_time, ramp_up):
+    """Run clients concurrent sessions issuing a weighted mix of commands"""
+    sizes = list(size_weights)
+    sources = prepare_sources(workdir, sizes)
+    seeded = seed_server(host, port, workdir, sources)
+    operations = list(mix)
+    stats = LoadStats()
+    deadline = time.perf_counter() + duration
+
+    def session_loop(index):
+        # Spread connection setup over the ramp-up period
+        time.sleep(ramp_up * index / max(clients, 1))
+        rng = random.Random(index)
+        session = Session(host, port, workdir, stats)
+        # Overwriting per-session names keeps the store at a steady size
+        uploads = session.link_sources(sources, f'load_{index}')
+        try:
+            while time.perf_counter() < deadline:
+                operation = rng.choices(operations, weights=[mix[op] for op in operations])[0]
+                size = rng.choices(sizes, weights=[size_weights[s] for s in sizes])[0]
+                if operation == 'UPLOAD':
+                    session.run('UPLOAD', source_path=uploads[size], size=size, overwrite=True)
+                elif operation == 'DOWNLOAD':
+                    session.run('DOWNLOAD', filename=seeded[size], size=size)
+                else:
+                    session.run('LIST')
+                if think_time:
+                    time.sleep(rng.expovariate(1 / think_time))
+        finally:
+            session.close()
+
+    threads = [threading.Thread(target=session_loop, args=(i,), daemon=True) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats.end_time = time.perf_counter()
+    return stats
+
+def parse_log(path):
+    """Reconstruct (timestamp, operation, filename) from a server or client log"""
+    operations = []
+    with open(path, encoding='utf-8', errors='replace') as f:
+        for line in f:
+            match = LOG_LINE.match(line.rstrip('\n'))
+            if not match:
+                continue
+            timestamp = datetime.strptime(match.group(1), '%Y-%m-%d %H:%M:%S,%f').timestamp()
+            for pattern, operation in LOG_OPERATIONS:
+                op_match = pattern.match(match.group(2))
+                if op_match:
+                    filename = op_match.group(1) if op_match.groups() else None
+                    operations.append((timestamp, operation, filename))
+                    break
+    operations.sort(key=lambda operation: operation[0])
+    return operations
+
+def run_replay(host, port, workdir, log_path, speed, max_gap, clients, replay_size):
+    """Replay logged commands with their original spacing, divided by speed"""
+    operations = parse_log(log_path)
+    if not operations:
+        raise RuntimeError(f"No replayable commands found in {log_path}")
+
+    # Recreate every logged filename locally so uploads and downloads use real names
+    source_dir = os.path.join(workdir, 'replay_sources')
+    os.makedirs(source_dir, exist_ok=True)
+    sources = {}
+    for _, _, filename in operations:
+        if filename and filename not in sources:
+            path = os.path.join(source_dir, os.path.basename(filename))
+            write_test_file(path, replay_size)
+            sources[filename] = path
+
+    # Seed every name so replayed uploads overwrite instead of piling up _vN copies
+    seed_stats = LoadStats()
+    seeder = Session(host, port, workdir, seed_stats)
+    try:
+        for filename, path in sources.items():
+            seeder.run('UPLOAD', source_path=path, size=replay_size, overwrite=True)
+    finally:
+        seeder.close()
+
+    # Compress long idle gaps (e.g. server restarts) before applying speed
+    schedule = []
+    offset = 0.0
+    previous = operations[0][0]
+    for timestamp, operation, filename in operations:
+        gap = timestamp - previous
+        if max_gap is not None:
+            gap = min(gap, max_gap)
+        offset += gap
+        previous = timestamp
+        schedule.append((offset / speed, operation, filename))
+
+    stats = LoadStats()
+    local = threading.local()
+    sessions = []
+    sessions_lock = threading.Lock()
+
+    def execute(operation, filename, scheduled):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = Session(host, port, workdir, stats)
+            with sessions_lock:
+                sessions.append(session)
+        session.run(operation, filename=filename, source_path=sources.get(filename),
+                    size=replay_size if filename else 0, overwrite=True, scheduled=scheduled)
+
+    print(f"Replaying {len(schedule)} commands over {schedule[-1][0]:.1f} s")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        for due, operation, filename in schedule:
+            delay = start + due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(execute, operation, filename, start + due)
+    stats.end_time = time.perf_counter()
+    for session in sessions:
+        session.close()
+    return stats
+
+def print_report(report):
+    print(f"Elapsed: {report['elapsed_s']:.2f} s")
+    print(f"{'operation':<10} {'count':>8} {'ops/s':>9} {'MB/s':>8} {'errors':>7} "
+          f"{'p50 ms':>9} {'p99 ms':>9} {'p999 ms':>9}")
+    for operation, result in report['operations'].items():
+        print(f"{operation:<10} {result['count']:>8} {result['ops_per_s']:>9.1f} {result['mb_per_s']:>8.1f} "
+              f"{result['error_rate']:>7.2%} {result['p50_ms']:>9.2f} {result['p99_ms']:>9.2f} {result['p999_ms']:>9.2f}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate concurrent client load against a file server")
+    parser.add_argument('--host', help="server to load (default: start one in-process on a free port)")
+    parser.add_argument('--port', type=int, default=9999)
+    parser.add_argument('--clients', type=int, default=50, help="concurrent simulated sessions")
+    parser.add_argument('--duration', type=float, default=30, help="seconds to run the mix for")
+    parser.add_argument('--mix', default='list=60,upload=20,download=20', help="weighted command mix")
+    parser.add_argument('--sizes', default='1KB:60,64KB:30,1MB:9,16MB:1', help="weighted file size distribution")
+    parser.add_argument('--think-time', type=float, default=0.0, help="mean pause between commands, in seconds")
+    parser.add_argument('--ramp-up', type=float, default=1.0, help="seconds over which sessions connect")
+    parser.add_argument('--replay', help="server_log.txt or client_log.txt to replay instead of the mix")
+    parser.add_argument('--speed', type=float, default=1.0, help="replay speed-up factor (1 = real time)")
+    parser.add_argument('--max-gap', type=float, help="cap idle gaps between replayed commands, in seconds")
+    parser.add_argument('--replay-size', default='64KB', help="size of files created for replayed transfers")
+    parser.add_argument('--output', help="write the report as JSON to this file")
+    args = parser.parse_args(argv)
+
+    mix = parse_weights(args.mix, lambda key: key.upper())
+    unknown = set(mix) - {'LIST', 'UPLOAD', 'DOWNLOAD'}
+    if unknown:
+        parser.error(f"unknown commands in --mix: {', '.join(sorted(unknown))}")
+    size_weights = parse_weights(args.sizes, parse_size)
+    replay_path = os.path.abspath(args.replay) if args.replay else None
+    output_path = os.path.abspath(args.output) if args.output else None
+
+    # Server and client log and store files relative to the working directory
+    workdir = tempfile.mkdtemp(prefix='fileshare-load-')
+    original_dir = os.getcwd()
+    os.chdir(workdir)
+    server = None
+    try:
+        if args.host:
+            host, port = args.host, args.port
+        else:
+            server = start_test_server(os.path.join(workdir, 'server_files'))
+            host, port = server.host, server.port
+
+        if replay_path:
+            stats = run_replay(host, port, workdir, replay_path, args.speed, args.max_gap,
+                               args.clients, parse_size(args.replay_size))
+        else:
+            print(f"Running {args.clients} sessions for {args.duration:.0f} s against {host}:{port}")
+            stats = run_mix(host, port, workdir, args.clients, args.duration, mix, size_weights,
+                            args.think_time, args.ramp_up)
+    finally:
+        if server:
+            server.stop()
+        os.chdir(original_dir)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = stats.report()
+    print_report(report)
+    if output_path:
+        with open(output_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {output_path}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,148 @@
+import bisect
+import os
+import threading
+from collections import defaultdict
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class MetricsShard:
+    """Counters and histograms written by a single handler thread"""
+
+    def __init__(self):
+        self.counters = defaultdict(int)
+        self.histograms = {}
+
+    def merge_into(self, counters, histograms):
+        for key, value in list(self.counters.items()):
+            counters[key] += value
+        for label, histogram in list(self.histograms.items()):
+            total = histograms.setdefault(label, [0] * (len(LATENCY_BUCKETS) + 3))
+            for i, value in enumerate(list(histogram)):
+                total[i] += value
+
+class ServerMetrics:
+    """Per-command counters and latency histograms for the server.
+
+    Each handler thread updates its own shard without taking a lock;
+    readers merge all shards. Shards of finished threads are folded into
+    a retired total so the number of live shards tracks the number of
+    live connections. Gauges are counters that go up and down.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.shards = []
+        self.retired = MetricsShard()
+
+    def shard(self):
+        shard = getattr(self.local, 'shard', None)
+        if shard is None:
+            shard = MetricsShard()
+            self.local.shard = shard
+            with self.lock:
+                self.shards.append(shard)
+        return shard
+
+    def inc(self, name, label='', value=1):
+        """Add value to a counter (or gauge) with an optional command label"""
+        self.shard().counters[(name, label)] += value
+
+    def dec(self, name, label='', value=1):
+        self.shard().counters[(name, label)] -= value
+
+    def observe(self, label, seconds):
+        """Record one command latency in the histogram for label"""
+        histograms = self.shard().histograms
+        histogram = histograms.get(label)
+        if histogram is None:
+            # Bucket counts, then the overflow bucket, the sum and the count
+            histogram = histograms[label] = [0] * (len(LATENCY_BUCKETS) + 3)
+        histogram[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        histogram[-2] += seconds
+        histogram[-1] += 1
+
+    def retire_thread(self):
+        """Fold the calling thread's shard into the retired totals"""
+        shard = getattr(self.local, 'shard', None)
+        if shard is None:
+            return
+        self.local.shard = None
+        with self.lock:
+            self.shards.remove(shard)
+            shard.merge_into(self.retired.counters, self.retired.histograms)
+
+    def collect(self):
+        """Merge all shards into (counters, histograms)"""
+        counters = defaultdict(int)
+        histograms = {}
+        with self.lock:
+            self.retired.merge_into(counters, histograms)
+            for shard in self.shards:
+                shard.merge_into(counters, histograms)
+        return counters, histograms
+
+    def snapshot(self):
+        """Return all metrics as a JSON-friendly dict"""
+        counters, histograms = self.collect()
+        result = {'counters': {}, 'latency': {}}
+        for (name, label), value in sorted(counters.items()):
+            if label:
+                result['counters'].setdefault(name, {})[label] = value
+            else:
+                result['counters'][name] = value
+        for label, histogram in sorted(histograms.items()):
+            count = histogram[-1]
+            result['latency'][label] = {
+                'count': count,
+                'mean': histogram[-2] / count if count else 0.0,
+                'p50': self.quantile(histogram, 0.5),
+                'p99': self.quantile(histogram, 0.99),
+                'buckets': dict(zip([str(bound) for bound in LATENCY_BUCKETS] + ['+Inf'], histogram[:-2]))
+            }
+        return result
+
+    @staticmethod
+    def quantile(histogram, q):
+        """Estimate a quantile as the upper bound of its bucket"""
+        count = histogram[-1]
+        if not count:
+            return 0.0
+        seen = 0
+        for bound, value in zip(LATENCY_BUCKETS, histogram):
+            seen += value
+            if seen >= q * count:
+                return bound
+        return float('inf')
+
+    def to_prometheus(self, prefix='fileserver'):
+        """Render all metrics in the Prometheus text exposition format"""
+        counters, histograms = self.collect()
+        lines = []
+        names = sorted({name for name, _ in counters})
+        for name in names:
+            metric = f"{prefix}_{name}"
+            kind = 'counter' if name.endswith('_total') else 'gauge'
+            lines.append(f"# TYPE {metric} {kind}")
+            for (counter_name, label), value in sorted(counters.items()):
+                if counter_name == name:
+                    labels = f'{{command="{label}"}}' if label else ''
+                    lines.append(f"{metric}{labels} {value}")
+
+        metric = f"{prefix}_command_duration_seconds"
+        lines.append(f"# TYPE {metric} histogram")
+        for label, histogram in sorted(histograms.items()):
+            cumulative = 0
+            for bound, value in zip([str(bound) for bound in LATENCY_BUCKETS] + ['+Inf'], histogram[:-2]):
+                cumulative += value
+                lines.append(f'{metric}_bucket{{command="{label}",le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_sum{{command="{label}"}} {histogram[-2]}')
+            lines.append(f'{metric}_count{{command="{label}"}} {histogram[-1]}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        """Atomically write the Prometheus text dump to path"""
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w') as f:
+            f.write(self.to_prometheus())
+        os.replace(temp_path, path)
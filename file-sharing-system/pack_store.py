@@ -0,0 +1,193 @@
+import json
+import logging
+import os
+import threading
+import time
+
+class PackStore:
+    """Append-only pack files for small uploads.
+
+    Small files are appended to large pack files instead of each getting
+    its own file, and an offset index maps names to (pack, offset, size,
+    hash, mtime). The index is an append-only JSON-lines journal replayed
+    on startup. Overwritten and deleted entries leave dead bytes behind;
+    compact() copies the live entries out of mostly dead packs and
+    deletes them.
+    """
+
+    def __init__(self, pack_dir, max_pack_size=64 * 1024 * 1024, compaction_ratio=0.5):
+        self.pack_dir = pack_dir
+        self.max_pack_size = max_pack_size
+        self.compaction_ratio = compaction_ratio
+        self.index_path = os.path.join(pack_dir, 'index.jsonl')
+        self.lock = threading.Lock()
+        # name -> (pack_id, offset, size, file_hash, mtime)
+        self.entries = {}
+        self.pack_sizes = {}
+        self.live_bytes = {}
+        self.pack_files = {}
+        self.journal_entries = 0
+
+        if not os.path.exists(self.pack_dir):
+            os.makedirs(self.pack_dir)
+
+        for filename in os.listdir(self.pack_dir):
+            if filename.startswith('pack-') and filename.endswith('.dat'):
+                pack_id = int(filename[5:-4])
+                self.pack_sizes[pack_id] = os.path.getsize(self.pack_path(pack_id))
+                self.live_bytes[pack_id] = 0
+        if os.path.exists(self.index_path):
+            self.replay()
+
+        self.current_pack = max(self.pack_sizes, default=0)
+        if self.current_pack == 0 or self.pack_sizes[self.current_pack] >= self.max_pack_size:
+            self.start_pack()
+        self.journal = open(self.index_path, 'a', encoding='utf-8')
+
+    def pack_path(self, pack_id):
+        return os.path.join(self.pack_dir, f'pack-{pack_id:06d}.dat')
+
+    def replay(self):
+        with open(self.index_path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    logging.error(f"Skipping unreadable pack index entry in {self.index_path}")
+                    continue
+                self.apply(entry)
+                self.journal_entries += 1
+
+        # Entries past the end of their pack were not fully written before a crash
+        for name, (pack_id, offset, size, _, _) in list(self.entries.items()):
+            if offset + size > self.pack_sizes.get(pack_id, -1):
+                self.apply({'op': 'delete', 'name': name})
+        logging.info(f"Loaded {len(self.entries)} packed files from {len(self.pack_sizes)} packs")
+
+    def apply(self, entry):
+        previous = self.entries.pop(entry['name'], None)
+        if previous is not None:
+            self.live_bytes[previous[0]] = self.live_bytes.get(previous[0], 0) - previous[2]
+        if entry['op'] == 'put':
+            self.entries[entry['name']] = (entry['pack'], entry['offset'], entry['size'], entry['hash'], entry['mtime'])
+            self.live_bytes[entry['pack']] = self.live_bytes.get(entry['pack'], 0) + entry['size']
+
+    def record(self, entry):
+        self.apply(entry)
+        self.journal.write(json.dumps(entry) + '\n')
+        self.journal.flush()
+        self.journal_entries += 1
+
+    def start_pack(self):
+        self.current_pack += 1
+        self.pack_sizes[self.current_pack] = 0
+        self.live_bytes[self.current_pack] = 0
+        open(self.pack_path(self.current_pack), 'ab').close()
+
+    def pack_file(self, pack_id):
+        pack_file = self.pack_files.get(pack_id)
+        if pack_file is None:
+            pack_file = self.pack_files[pack_id] = open(self.pack_path(pack_id), 'r+b')
+        return pack_file
+
+    def append_locked(self, name, data, file_hash, mtime):
+        if self.pack_sizes[self.current_pack] + len(data) > self.max_pack_size:
+            self.start_pack()
+        pack_id = self.current_pack
+        offset = self.pack_sizes[pack_id]
+        pack_file = self.pack_file(pack_id)
+        pack_file.seek(offset)
+        pack_file.write(data)
+        pack_file.flush()
+        self.pack_sizes[pack_id] = offset + len(data)
+        self.record({
+            'op': 'put', 'name': name, 'pack': pack_id, 'offset': offset,
+            'size': len(data), 'hash': file_hash, 'mtime': mtime
+        })
+
+    def put(self, name, data, file_hash):
+        """Store a file's bytes, superseding any earlier entry of the same name"""
+        with self.lock:
+            self.append_locked(name, data, file_hash, time.time())
+            return self.entries[name]
+
+    def get(self, name):
+        """Return (pack_id, offset, size, file_hash, mtime) for a packed file, or None"""
+        with self.lock:
+            return self.entries.get(name)
+
+    def contains(self, name):
+        return name in self.entries
+
+    def read(self, name):
+        """Return (entry, data) for a packed file, or None if it is not packed"""
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is None:
+                return None
+            pack_id, offset, size = entry[:3]
+            pack_file = self.pack_file(pack_id)
+            pack_file.seek(offset)
+            return entry, pack_file.read(size)
+
+    def delete(self, name):
+        """Drop a packed file; its bytes are reclaimed by the next compaction"""
+        with self.lock:
+            if name in self.entries:
+                self.record({'op': 'delete', 'name': name})
+
+    def list_entries(self):
+        """Return [(name, size, mtime)] for every packed file"""
+        with self.lock:
+            return [(name, entry[2], entry[4]) for name, entry in self.entries.items()]
+
+    def compact(self):
+        """Rewrite mostly dead packs and the index; returns bytes reclaimed"""
+        reclaimed = 0
+        removed = False
+        with self.lock:
+            for pack_id in sorted(self.pack_sizes):
+                total = self.pack_sizes[pack_id]
+                if pack_id == self.current_pack:
+                    continue
+                if total and self.live_bytes.get(pack_id, 0) / total > self.compaction_ratio:
+                    continue
+
+                # Move live entries to the current pack, keeping their hash and mtime
+                pack_file = self.pack_file(pack_id)
+                for name, (entry_pack, offset, size, file_hash, mtime) in list(self.entries.items()):
+                    if entry_pack == pack_id:
+                        pack_file.seek(offset)
+                        self.append_locked(name, pack_file.read(size), file_hash, mtime)
+
+                pack_file.close()
+                del self.pack_files[pack_id]
+                os.remove(self.pack_path(pack_id))
+                del self.pack_sizes[pack_id]
+                self.live_bytes.pop(pack_id, None)
+                reclaimed += total
+                removed = True
+                logging.info(f"Compacted pack {pack_id}, reclaimed {total} bytes")
+
+            if removed or self.journal_entries > 2 * len(self.entries) + 1000:
+                self.rewrite_index_locked()
+        return reclaimed
+
+    def rewrite_index_locked(self):
+        temp_path = self.index_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            for name, (pack_id, offset, size, file_hash, mtime) in self.entries.items():
+                f.write(json.dumps({
+                    'op': 'put', 'name': name, 'pack': pack_id, 'offset': offset,
+                    'size': size, 'hash': file_hash, 'mtime': mtime
+                }) + '\n')
+        self.journal.close()
+        os.replace(temp_path, self.index_path)
+        self.journal = open(self.index_path, 'a', encoding='utf-8')
+        self.journal_entries = len(self.entries)
+
+    def stats(self):
+        with self.lock:
+            total = sum(self.pack_sizes.values())
+            live = sum(self.live_bytes.values())
+            return {'files': len(self.entries), 'packs': len(self.pack_sizes), 'bytes': total, 'live_bytes': live}
@@ -1,10 +1,22 @@
 import socket
 import threading
 import os
+import queue
 import json
 import hashlib
+import io
 import logging
+import mmap
+import re
+import stat
+import time
 from datetime import datetime
+from file_cache import FileCache
+from file_index import FileIndex
+from metrics import ServerMetrics
+from pack_store import PackStore
+from tracing import Tracer
+from usage_ledger import UsageLedger
 
 # Configure logging
 logging.basicConfig(
@@ -14,16 +26,88 @@ logging.basicConfig(
 )
 
 class FileServer:
-    def __init__(self, host='localhost', port=9999):
+    COMMANDS = ('LIST', 'UPLOAD', 'DOWNLOAD', 'SEARCH', 'STATS', 'CACHE_STATS', 'USAGE', 'WATCH')
+    
+    def __init__(self, host='localhost', port=9999, trace_file=None, profile_sample_rate=0.0,
+                 metrics_file=None, metrics_interval=10, storage_dir='server_files',
+                 ledger_file=None, quota_file=None, default_quota=None, max_versions=None,
+                 small_file_limit=4096, compaction_interval=300):
         self.host = host
         self.port = port
         self.server_socket = None
         self.clients = []
-        self.storage_dir = 'server_files'
+        self.storage_dir = storage_dir
+        self.running = False
+        self.ready = threading.Event()
+        
+        # Change notifications for WATCH subscribers
+        # Each watcher has a bounded queue drained by its own sender thread, so a
+        # subscriber that stops reading is dropped instead of stalling the rest
+        self.watchers = {}
+        self.watchers_lock = threading.Lock()
+        self.watcher_queue_size = 64
+        self.pending_events = {}
+        self.events_condition = threading.Condition()
+        self.event_coalesce_interval = 0.25
         
         # Create storage directory if it doesn't exist
         if not os.path.exists(self.storage_dir):
             os.makedirs(self.storage_dir)
+        
+        # Overwrites are received here first and then swapped into place
+        self.incoming_dir = os.path.join(self.storage_dir, '.incoming')
+        if not os.path.exists(self.incoming_dir):
+            os.makedirs(self.incoming_dir)
+        for leftover in os.listdir(self.incoming_dir):
+            os.remove(os.path.join(self.incoming_dir, leftover))
+        
+        # Per-user quotas, checked against incrementally maintained usage.
+        # quota_file holds {"default": bytes, "users": {"name": bytes}}; null means unlimited.
+        quotas = {}
+        if quota_file:
+            with open(quota_file) as f:
+                quota_config = json.load(f)
+            quotas = quota_config.get('users', {})
+            if default_quota is None:
+                default_quota = quota_config.get('default')
+        # The ledger lives with the files it accounts for, like .packs and .incoming
+        if ledger_file is None:
+            ledger_dir = os.path.join(self.storage_dir, '.ledger')
+            os.makedirs(ledger_dir, exist_ok=True)
+            ledger_file = os.path.join(ledger_dir, 'usage_ledger.jsonl')
+        self.usage_ledger = UsageLedger(ledger_file, quotas, default_quota)
+        
+        # Upload commits and removals of one name run one at a time
+        self.commit_locks = [threading.Lock() for _ in range(64)]
+        
+        # Keep at most this many versions (name.ext, name_v1.ext, ...) of each file
+        self.max_versions = max_versions
+        
+        # Uploads up to small_file_limit bytes are appended to pack files instead
+        # of getting a file each; 0 disables packing
+        self.small_file_limit = small_file_limit
+        self.compaction_interval = compaction_interval
+        self.pack_store = PackStore(os.path.join(self.storage_dir, '.packs'))
+        
+        # Metadata index used by SEARCH
+        self.file_index = FileIndex()
+        self.file_index.build(self.storage_dir, self.pack_store.list_entries())
+        
+        # Files stored before the ledger existed are charged to the default user
+        if self.usage_ledger.is_new:
+            self.usage_ledger.seed(
+                [(name, size) for name, size, _ in self.file_index.list_entries()], 'anonymous')
+        
+        # Hot-file cache of download headers and small file bodies
+        self.file_cache = FileCache()
+        
+        # Per-phase spans for every command; add hooks with self.tracer.add_hook
+        self.tracer = Tracer(trace_file, profile_sample_rate)
+        
+        # Counters and latency histograms served by STATS and dumped to metrics_file
+        self.metrics = ServerMetrics()
+        self.metrics_file = metrics_file
+        self.metrics_interval = metrics_interval
             
         print(f"Server initialized. Files will be stored in '{self.storage_dir}'")
         logging.info(f"Server initialized on {host}:{port}")
@@ -35,12 +119,38 @@ class FileServer:
         
         try:
             self.server_socket.bind((self.host, self.port))
-            self.server_socket.listen(5)
+            # A deep backlog keeps bursts of simultaneous connects from being refused
+            self.server_socket.listen(socket.SOMAXCONN)
+            # Port 0 asks the OS for a free port
+            self.port = self.server_socket.getsockname()[1]
+            self.running = True
+            self.ready.set()
             print(f"Server started on {self.host}:{self.port}")
             logging.info(f"Server started on {self.host}:{self.port}")
             
-            while True:
-                client_socket, address = self.server_socket.accept()
+            # Start the thread that pushes change events to watchers
+            notifier_thread = threading.Thread(target=self.notify_watchers)
+            notifier_thread.daemon = True
+            notifier_thread.start()
+            
+            # Reclaim space held by overwritten and deleted packed files
+            compaction_thread = threading.Thread(target=self.compact_packs)
+            compaction_thread.daemon = True
+            compaction_thread.start()
+            
+            # Periodically dump metrics in Prometheus text format
+            if self.metrics_file:
+                metrics_thread = threading.Thread(target=self.dump_metrics)
+                metrics_thread.daemon = True
+                metrics_thread.start()
+            
+            while self.running:
+                try:
+                    client_socket, address = self.server_socket.accept()
+                except OSError:
+                    if not self.running:
+                        break
+                    raise
                 print(f"New connection from {address}")
                 logging.info(f"New connection from {address}")
                 
@@ -62,9 +172,23 @@ class FileServer:
         finally:
             if self.server_socket:
                 self.server_socket.close()
+            self.tracer.export()
+            if self.metrics_file:
+                self.metrics.write_prometheus(self.metrics_file)
+    
+    def stop(self):
+        """Stop accepting connections and make start() return"""
+        self.running = False
+        if self.server_socket:
+            try:
+                self.server_socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.server_socket.close()
     
     def handle_client(self, client_socket, address):
         """Handle client requests"""
+        self.metrics.inc('active_connections')
         try:
             while True:
                 # Receive the command header
@@ -73,42 +197,90 @@ class FileServer:
                     break
                 
                 # Parse the header
-                header = json.loads(header_data.decode('utf-8'))
+                with self.tracer.span('parse') as span:
+                    span.add_bytes(len(header_data))
+                    header = json.loads(header_data.decode('utf-8'))
                 command = header.get('command')
+                label = command if command in self.COMMANDS else 'INVALID'
+                self.metrics.inc('requests_total', label)
+                self.metrics.inc('bytes_in_total', label, len(header_data))
                 
-                if command == 'LIST':
-                    self.handle_list(client_socket)
-                elif command == 'UPLOAD':
-                    self.handle_upload(client_socket, header)
-                elif command == 'DOWNLOAD':
-                    self.handle_download(client_socket, header)
-                else:
-                    response = {'status': 'error', 'message': 'Invalid command'}
-                    client_socket.send(json.dumps(response).encode('utf-8'))
+                start_time = time.perf_counter()
+                with self.tracer.profile(str(command)), self.tracer.span(str(command), category='command'):
+                    self.dispatch(client_socket, command, header)
+                self.metrics.observe(label, time.perf_counter() - start_time)
         
         except Exception as e:
             print(f"Error handling client {address}: {e}")
             logging.error(f"Error handling client {address}: {e}")
+            self.metrics.inc('connection_errors_total')
         finally:
+            self.metrics.dec('active_connections')
+            self.metrics.retire_thread()
+            self.remove_watcher(client_socket)
             client_socket.close()
             print(f"Connection from {address} closed")
             logging.info(f"Connection from {address} closed")
     
-    def handle_list(self, client_socket):
+    def dispatch(self, client_socket, command, header):
+        """Route a parsed command to its handler"""
+        if command == 'LIST':
+            self.handle_list(client_socket, header)
+        elif command == 'UPLOAD':
+            self.handle_upload(client_socket, header)
+        elif command == 'DOWNLOAD':
+            self.handle_download(client_socket, header)
+        elif command == 'SEARCH':
+            self.handle_search(client_socket, header)
+        elif command == 'STATS':
+            self.handle_stats(client_socket, header)
+        elif command == 'CACHE_STATS':
+            self.handle_cache_stats(client_socket, header)
+        elif command == 'USAGE':
+            self.handle_usage(client_socket, header)
+        elif command == 'WATCH':
+            self.handle_watch(client_socket)
+        else:
+            self.metrics.inc('errors_total', 'INVALID')
+            response = {'status': 'error', 'message': 'Invalid command'}
+            client_socket.send(json.dumps(response).encode('utf-8'))
+    
+    def encode_response(self, header, response):
+        """Encode a JSON response, length-prefixed if the client asked for framing.
+        
+        Responses that can outgrow one recv (LIST, SEARCH, STATS) are preceded
+        by a line holding their byte length when the request header has
+        'framed': true, so clients know exactly how much to read.
+        """
+        response_data = json.dumps(response).encode('utf-8')
+        if header.get('framed'):
+            return f"{len(response_data)}\n".encode('utf-8') + response_data
+        return response_data
+    
+    def handle_list(self, client_socket, header):
         """Handle LIST command - send list of available files"""
         try:
-            files = []
-            for filename in os.listdir(self.storage_dir):
-                file_path = os.path.join(self.storage_dir, filename)
-                if os.path.isfile(file_path):
-                    file_size = os.path.getsize(file_path)
-                    modified_time = os.path.getmtime(file_path)
-                    modified_time_str = datetime.fromtimestamp(modified_time).strftime('%Y-%m-%d %H:%M:%S')
-                    
+            with self.tracer.span('metadata'):
+                files = []
+                for filename in os.listdir(self.storage_dir):
+                    file_path = os.path.join(self.storage_dir, filename)
+                    if os.path.isfile(file_path):
+                        file_size = os.path.getsize(file_path)
+                        modified_time = os.path.getmtime(file_path)
+                        modified_time_str = datetime.fromtimestamp(modified_time).strftime('%Y-%m-%d %H:%M:%S')
+                        
+                        files.append({
+                            'name': filename,
+                            'size': file_size,
+                            'modified': modified_time_str
+                        })
+                
+                # Small files live in pack files but list like any other file
+                for filename, file_size, modified_time in self.pack_store.list_entries():
                     files.append({
                         'name': filename,
                         'size': file_size,
-                        'modified': modified_time_str
+                        'modified': datetime.fromtimestamp(modified_time).strftime('%Y-%m-%d %H:%M:%S')
                     })
             
             response = {
@@ -116,12 +288,17 @@ class FileServer:
                 'files': files
             }
             
-            client_socket.send(json.dumps(response).encode('utf-8'))
+            with self.tracer.span('network') as span:
+                response_data = self.encode_response(header, response)
+                span.add_bytes(len(response_data))
+                client_socket.sendall(response_data)
+            self.metrics.inc('bytes_out_total', 'LIST', len(response_data))
             logging.info("Sent file list to client")
             
         except Exception as e:
+            self.metrics.inc('errors_total', 'LIST')
             response = {'status': 'error', 'message': str(e)}
-            client_socket.send(json.dumps(response).encode('utf-8'))
+            client_socket.sendall(self.encode_response(header, response))
             logging.error(f"Error in LIST command: {e}")
     
     def handle_upload(self, client_socket, header):
@@ -131,88 +308,255 @@ class FileServer:
         file_hash = header.get('file_hash')
         
         if not all([filename, file_size, file_hash]):
+            self.metrics.inc('errors_total', 'UPLOAD')
             response = {'status': 'error', 'message': 'Missing file information'}
             client_socket.send(json.dumps(response).encode('utf-8'))
             return
         
+        user = header.get('user') or 'anonymous'
+        base_filename = filename
+        replaced = None
+        
         # Check if file exists and handle duplicates
-        target_path = os.path.join(self.storage_dir, filename)
-        if os.path.exists(target_path):
-            # Handle duplicate - rename with version number
-            name, ext = os.path.splitext(filename)
-            version = 1
-            while os.path.exists(target_path):
-                new_filename = f"{name}_v{version}{ext}"
-                target_path = os.path.join(self.storage_dir, new_filename)
-                version += 1
-            filename = os.path.basename(target_path)
-        
-        # Send ready signal to client
-        response = {'status': 'ready', 'filename': filename}
-        client_socket.send(json.dumps(response).encode('utf-8'))
-        
-        # Receive file data
+        with self.tracer.span('metadata'):
+            target_path = os.path.join(self.storage_dir, filename)
+            if self.file_exists(filename) and header.get('overwrite'):
+                replaced = filename
+            elif self.file_exists(filename):
+                # Handle duplicate - rename with version number
+                name, ext = os.path.splitext(filename)
+                version = 1
+                while self.file_exists(os.path.basename(target_path)):
+                    new_filename = f"{name}_v{version}{ext}"
+                    target_path = os.path.join(self.storage_dir, new_filename)
+                    version += 1
+                filename = os.path.basename(target_path)
+            
+            # Receive into a private temporary file and move it into place on
+            # commit, so readers and concurrent uploads never see a partial file
+            write_path = os.path.join(self.incoming_dir, f"{threading.get_ident()}-{filename}")
+        
+        # Enforce the user's quota before accepting any bytes
+        if not self.usage_ledger.reserve(user, file_size, replaced):
+            used, reserved, quota = self.usage_ledger.usage_for(user)
+            self.metrics.inc('quota_rejections_total', 'UPLOAD')
+            response = {
+                'status': 'error',
+                'message': f'Quota exceeded: {user} is using {used + reserved} of {quota} bytes'
+            }
+            client_socket.send(json.dumps(response).encode('utf-8'))
+            logging.info(f"Rejected upload of {filename} by {user}: quota exceeded")
+            return
+        
+        # The reservation is released on every path that does not commit it
+        committed = False
+        self.metrics.inc('active_transfers')
         try:
+            # Send ready signal to client
+            with self.tracer.span('network'):
+                response = {'status': 'ready', 'filename': filename}
+                client_socket.send(json.dumps(response).encode('utf-8'))
+            
+            # Receive file data
             received_size = 0
             hash_obj = hashlib.sha256()
             
-            with open(target_path, 'wb') as f:
+            # Small files are collected in memory and appended to a pack file
+            packed = bool(self.small_file_limit) and file_size <= self.small_file_limit
+            
+            # The receive loop interleaves phases, so time each one and record the totals
+            loop_start = time.perf_counter()
+            network_time = hash_time = disk_time = 0.0
+            with (io.BytesIO() if packed else open(write_path, 'wb')) as f:
                 while received_size < file_size:
                     chunk_size = min(4096, file_size - received_size)
+                    phase_start = time.perf_counter()
                     chunk = client_socket.recv(chunk_size)
+                    phase_end = time.perf_counter()
+                    network_time += phase_end - phase_start
                     if not chunk:
                         break
                     
                     hash_obj.update(chunk)
+                    phase_start = time.perf_counter()
+                    hash_time += phase_start - phase_end
                     f.write(chunk)
+                    disk_time += time.perf_counter() - phase_start
                     received_size += len(chunk)
+                
+                data = f.getvalue() if packed else None
+            
+            self.tracer.record('network', loop_start, network_time, size=received_size)
+            self.tracer.record('hash', loop_start, hash_time, size=received_size)
+            self.tracer.record('disk', loop_start, disk_time, size=received_size)
+            self.metrics.inc('bytes_in_total', 'UPLOAD', received_size)
             
             # Verify file integrity
             calculated_hash = hash_obj.hexdigest()
             if calculated_hash == file_hash:
+                # Concurrent uploads of one name may land in different tiers, so
+                # each commits all of its bookkeeping before the next one starts
+                with self.commit_lock(filename):
+                    if packed:
+                        with self.tracer.span('disk', packed=True) as span:
+                            span.add_bytes(received_size)
+                            entry = self.pack_store.put(filename, data, calculated_hash)
+                        # An overwrite may replace a file that was stored on its own
+                        try:
+                            os.remove(target_path)
+                        except FileNotFoundError:
+                            pass
+                        stored_size, stored_mtime = entry[2], entry[4]
+                    else:
+                        os.replace(write_path, target_path)
+                        self.pack_store.delete(filename)
+                        stored_size, stored_mtime = os.path.getsize(target_path), os.path.getmtime(target_path)
+                    self.usage_ledger.commit(filename, user, received_size, reserved_size=file_size)
+                    committed = True
+                    self.file_cache.invalidate(filename)
+                    self.file_index.add(filename, stored_size, stored_mtime)
+                    self.publish_event('modified' if replaced else 'added', filename)
                 response = {'status': 'success', 'message': f'File {filename} uploaded successfully'}
                 logging.info(f"File {filename} uploaded successfully")
+                if self.max_versions:
+                    self.prune_versions(base_filename, filename)
             else:
                 response = {'status': 'error', 'message': 'File integrity check failed'}
                 logging.error(f"File integrity check failed for {filename}")
+                self.metrics.inc('integrity_failures_total', 'UPLOAD')
                 # Delete the corrupted file
-                os.remove(target_path)
+                if not packed:
+                    os.remove(write_path)
             
-            client_socket.send(json.dumps(response).encode('utf-8'))
+            with self.tracer.span('confirm'):
+                client_socket.send(json.dumps(response).encode('utf-8'))
             
         except Exception as e:
-            response = {'status': 'error', 'message': str(e)}
-            client_socket.send(json.dumps(response).encode('utf-8'))
+            self.metrics.inc('errors_total', 'UPLOAD')
             logging.error(f"Error in UPLOAD command: {e}")
             # Clean up partial file
-            if os.path.exists(target_path):
-                os.remove(target_path)
+            if not committed:
+                try:
+                    os.remove(write_path)
+                except FileNotFoundError:
+                    pass
+            response = {'status': 'error', 'message': str(e)}
+            client_socket.send(json.dumps(response).encode('utf-8'))
+        finally:
+            if not committed:
+                self.usage_ledger.release(user, file_size)
+            self.metrics.dec('active_transfers')
+    
+    def prune_versions(self, base_filename, newest_filename):
+        """Delete the oldest versions of a file beyond max_versions"""
+        name, ext = os.path.splitext(base_filename)
+        pattern = re.compile(re.escape(name) + r'(?:_v(\d+))?' + re.escape(ext))
+        _, candidates = self.file_index.search(prefix=name, limit=None)
+        
+        # Freed names get reused, so order by modification time rather than version number
+        versions = []
+        for file_info in candidates:
+            match = pattern.fullmatch(file_info['name'])
+            record = self.file_index.get(file_info['name'])
+            if match and record and file_info['name'] != newest_filename:
+                versions.append((record[1], int(match.group(1) or 0), file_info['name']))
+        versions.sort()
+        
+        for _, _, old_filename in versions[:max(len(versions) - (self.max_versions - 1), 0)]:
+            self.remove_file(old_filename)
+            logging.info(f"Pruned old version {old_filename}")
+    
+    def file_exists(self, filename):
+        """Check whether a file is stored, either on its own or in a pack"""
+        return os.path.exists(os.path.join(self.storage_dir, filename)) or self.pack_store.contains(filename)
+    
+    def commit_lock(self, filename):
+        """Return the lock that serializes commits and removals of filename"""
+        return self.commit_locks[hash(filename) % len(self.commit_locks)]
+    
+    def remove_file(self, filename):
+        """Delete a stored file and update the index, cache, ledger and watchers"""
+        with self.commit_lock(filename):
+            try:
+                os.remove(os.path.join(self.storage_dir, filename))
+            except FileNotFoundError:
+                pass
+            self.pack_store.delete(filename)
+            self.file_index.remove(filename)
+            self.file_cache.invalidate(filename)
+            self.usage_ledger.remove(filename)
+            self.publish_event('removed', filename)
     
     def handle_download(self, client_socket, header):
         """Handle DOWNLOAD command - send file to client"""
         filename = header.get('filename')
         
         if not filename:
+            self.metrics.inc('errors_total', 'DOWNLOAD')
             response = {'status': 'error', 'message': 'Missing filename'}
             client_socket.send(json.dumps(response).encode('utf-8'))
             return
         
         file_path = os.path.join(self.storage_dir, filename)
         
-        if not os.path.exists(file_path) or not os.path.isfile(file_path):
-            response = {'status': 'error', 'message': 'File not found'}
-            client_socket.send(json.dumps(response).encode('utf-8'))
-            return
+        # Version, hash and body all come from this one descriptor, so an
+        # overwrite or prune during the download cannot change what is sent
+        file_handle = None
+        pack_entry = None
+        try:
+            with self.tracer.span('metadata'):
+                file_handle = open(file_path, 'rb')
+                file_stat = os.fstat(file_handle.fileno())
+        except OSError:
+            file_stat = None
+        if file_stat is None or not stat.S_ISREG(file_stat.st_mode):
+            if file_handle is not None:
+                file_handle.close()
+                file_handle = None
+            pack_entry = self.pack_store.get(filename)
+            if pack_entry is None:
+                self.metrics.inc('errors_total', 'DOWNLOAD')
+                response = {'status': 'error', 'message': 'File not found'}
+                client_socket.send(json.dumps(response).encode('utf-8'))
+                return
         
         try:
-            file_size = os.path.getsize(file_path)
+            # Hot files are served from the cache without touching the disk
+            if pack_entry is not None:
+                version = ('pack', pack_entry[0], pack_entry[1])
+            else:
+                version = (file_stat.st_size, file_stat.st_mtime_ns)
+            cached = self.file_cache.get(filename, version)
+            if cached is not None:
+                file_size, file_hash, body = cached
+            elif pack_entry is not None:
+                # Packed files are one offset read, and their hash was stored at upload
+                with self.tracer.span('disk', packed=True) as span:
+                    packed = self.pack_store.read(filename)
+                    if packed is None:
+                        raise FileNotFoundError(f"File {filename} was removed")
+                    pack_entry, body = packed
+                    span.add_bytes(len(body))
+                file_size, file_hash = pack_entry[2], pack_entry[3]
+                version = ('pack', pack_entry[0], pack_entry[1])
+                self.file_cache.put(filename, version, file_size, file_hash, body)
+            else:
+                file_size, file_hash, body = self.read_for_download(file_handle, file_stat.st_size)
+                self.file_cache.put(filename, version, file_size, file_hash, body)
             
-            # Calculate file hash
-            hash_obj = hashlib.sha256()
-            with open(file_path, 'rb') as f:
-                while chunk := f.read(4096):
-                    hash_obj.update(chunk)
-            file_hash = hash_obj.hexdigest()
+            # The client already holds this exact content - skip the body
+            if header.get('known_hash') == file_hash:
+                response = {
+                    'status': 'not_modified',
+                    'filename': filename,
+                    'file_size': file_size,
+                    'file_hash': file_hash
+                }
+                with self.tracer.span('network'):
+                    client_socket.send(json.dumps(response).encode('utf-8'))
+                logging.info(f"File {filename} not modified for client")
+                self.metrics.inc('not_modified_total', 'DOWNLOAD')
+                return
             
             # Send file info to client
             response = {
@@ -221,24 +565,238 @@ class FileServer:
                 'file_size': file_size,
                 'file_hash': file_hash
             }
-            client_socket.send(json.dumps(response).encode('utf-8'))
+            with self.tracer.span('network'):
+                client_socket.send(json.dumps(response).encode('utf-8'))
             
             # Wait for client to confirm ready to receive
-            client_response = json.loads(client_socket.recv(1024).decode('utf-8'))
+            with self.tracer.span('confirm'):
+                client_response = json.loads(client_socket.recv(1024).decode('utf-8'))
             if client_response.get('status') != 'ready':
                 return
             
-            # Send file data
-            with open(file_path, 'rb') as f:
-                while chunk := f.read(4096):
-                    client_socket.send(chunk)
+            # Send file data - cached bytes in one write, larger files from a memory map
+            self.metrics.inc('active_transfers')
+            try:
+                with self.tracer.span('network', cached=body is not None) as span:
+                    span.add_bytes(file_size)
+                    if body is not None:
+                        client_socket.sendall(body)
+                    elif file_size > 0:
+                        with mmap.mmap(file_handle.fileno(), file_size, access=mmap.ACCESS_READ) as mapped:
+                            client_socket.sendall(mapped)
+            finally:
+                self.metrics.dec('active_transfers')
+            self.metrics.inc('bytes_out_total', 'DOWNLOAD', file_size)
             
             logging.info(f"File {filename} downloaded by client")
             
         except Exception as e:
+            self.metrics.inc('errors_total', 'DOWNLOAD')
             response = {'status': 'error', 'message': str(e)}
             client_socket.send(json.dumps(response).encode('utf-8'))
             logging.error(f"Error in DOWNLOAD command: {e}")
+        finally:
+            if file_handle is not None:
+                file_handle.close()
+
+    def read_for_download(self, f, file_size):
+        """Hash the first file_size bytes of an open file, returning (file_size, file_hash, body).
+        
+        Files small enough to cache are read whole and their bytes returned
+        as body; larger files are hashed through a memory map and body is None.
+        """
+        if file_size <= self.file_cache.max_entry_size:
+            with self.tracer.span('disk') as span:
+                body = f.read(file_size)
+                span.add_bytes(len(body))
+            with self.tracer.span('hash') as span:
+                span.add_bytes(len(body))
+                file_hash = hashlib.sha256(body).hexdigest()
+            return len(body), file_hash, body
+        
+        # Pages are read lazily, so disk time for large files shows up under hash
+        with mmap.mmap(f.fileno(), file_size, access=mmap.ACCESS_READ) as mapped:
+            with self.tracer.span('hash', mapped=True) as span:
+                span.add_bytes(file_size)
+                file_hash = hashlib.sha256(mapped).hexdigest()
+            return file_size, file_hash, None
+    
+    def handle_stats(self, client_socket, header):
+        """Handle STATS command - send live counters and latency histograms"""
+        stats = self.metrics.snapshot()
+        stats['cache'] = self.file_cache.stats()
+        stats['watchers'] = len(self.watchers)
+        stats['packs'] = self.pack_store.stats()
+        response = {'status': 'success', 'stats': stats}
+        client_socket.sendall(self.encode_response(header, response))
+    
+    def compact_packs(self):
+        """Compact pack files every compaction_interval seconds"""
+        while True:
+            time.sleep(self.compaction_interval)
+            try:
+                reclaimed = self.pack_store.compact()
+                if reclaimed:
+                    logging.info(f"Pack compaction reclaimed {reclaimed} bytes")
+            except OSError as e:
+                logging.error(f"Error compacting pack files: {e}")
+    
+    def dump_metrics(self):
+        """Write the Prometheus metrics file every metrics_interval seconds"""
+        while True:
+            time.sleep(self.metrics_interval)
+            try:
+                self.metrics.write_prometheus(self.metrics_file)
+            except OSError as e:
+                logging.error(f"Error writing metrics file: {e}")
+    
+    def handle_usage(self, client_socket, header):
+        """Handle USAGE command - send a user's storage usage and quota"""
+        user = header.get('user') or 'anonymous'
+        used, reserved, quota = self.usage_ledger.usage_for(user)
+        response = {'status': 'success', 'user': user, 'used': used, 'reserved': reserved, 'quota': quota}
+        client_socket.sendall(self.encode_response(header, response))
+    
+    def handle_cache_stats(self, client_socket, header):
+        """Handle CACHE_STATS command - send hot-file cache counters"""
+        response = {'status': 'success', 'cache': self.file_cache.stats()}
+        client_socket.sendall(self.encode_response(header, response))
+    
+    def handle_search(self, client_socket, header):
+        """Handle SEARCH command - query the file metadata index"""
+        try:
+            with self.tracer.span('metadata'):
+                total, files = self.file_index.search(
+                    prefix=header.get('prefix'),
+                    contains=header.get('contains'),
+                    glob=header.get('glob'),
+                    extension=header.get('extension'),
+                    min_size=header.get('min_size'),
+                    max_size=header.get('max_size'),
+                    modified_after=header.get('modified_after'),
+                    modified_before=header.get('modified_before'),
+                    sort_by=header.get('sort_by', 'name'),
+                    descending=header.get('descending', False),
+                    limit=header.get('limit', 100)
+                )
+            
+            response = {
+                'status': 'success',
+                'total': total,
+                'files': files
+            }
+            
+            with self.tracer.span('network') as span:
+                response_data = self.encode_response(header, response)
+                span.add_bytes(len(response_data))
+                client_socket.sendall(response_data)
+            self.metrics.inc('bytes_out_total', 'SEARCH', len(response_data))
+            logging.info(f"Sent {len(files)} of {total} search results to client")
+            
+        except Exception as e:
+            self.metrics.inc('errors_total', 'SEARCH')
+            response = {'status': 'error', 'message': str(e)}
+            client_socket.sendall(self.encode_response(header, response))
+            logging.error(f"Error in SEARCH command: {e}")
+    
+    def handle_watch(self, client_socket):
+        """Handle WATCH command - subscribe the connection to change events"""
+        response = {'status': 'success', 'message': 'Watching for changes'}
+        client_socket.sendall((json.dumps(response) + '\n').encode('utf-8'))
+        with self.watchers_lock:
+            if client_socket in self.watchers:
+                return
+            events = queue.Queue(maxsize=self.watcher_queue_size)
+            self.watchers[client_socket] = events
+        sender_thread = threading.Thread(target=self.send_to_watcher, args=(client_socket, events))
+        sender_thread.daemon = True
+        sender_thread.start()
+        logging.info("Client subscribed to change events")
+    
+    def remove_watcher(self, client_socket):
+        """Unsubscribe a connection from change events"""
+        with self.watchers_lock:
+            events = self.watchers.pop(client_socket, None)
+        if events is not None:
+            try:
+                # Wake the sender thread so it exits
+                events.put_nowait(None)
+            except queue.Full:
+                pass
+            logging.info("Client unsubscribed from change events")
+    
+    def drop_watcher(self, client_socket):
+        """Unsubscribe a watcher that cannot keep up and close its connection"""
+        self.remove_watcher(client_socket)
+        try:
+            # Unblocks a stalled send and makes the connection's handler exit
+            client_socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    
+    def send_to_watcher(self, client_socket, events):
+        """Send queued event batches to one watcher until it unsubscribes"""
+        while True:
+            message = events.get()
+            if message is None:
+                return
+            try:
+                client_socket.sendall(message)
+            except OSError as e:
+                logging.error(f"Error pushing events to watcher: {e}")
+                self.drop_watcher(client_socket)
+                return
+    
+    def publish_event(self, event_type, filename):
+        """Queue a change event (added, removed or modified) for watchers"""
+        event = {'event': event_type, 'name': filename}
+        if event_type != 'removed':
+            # The index covers packed files too, which have no path of their own
+            record = self.file_index.get(filename)
+            if record is None:
+                return
+            event['size'] = record[0]
+            event['modified'] = datetime.fromtimestamp(record[1]).strftime('%Y-%m-%d %H:%M:%S')
+        
+        with self.events_condition:
+            # Coalesce with any event for the same file still waiting to be sent
+            previous = self.pending_events.get(filename)
+            if previous is not None:
+                if previous['event'] == 'added' and event_type == 'removed':
+                    del self.pending_events[filename]
+                    return
+                if previous['event'] == 'added' and event_type == 'modified':
+                    event['event'] = 'added'
+                elif previous['event'] == 'removed' and event_type == 'added':
+                    event['event'] = 'modified'
+            self.pending_events[filename] = event
+            self.events_condition.notify()
+    
+    def notify_watchers(self):
+        """Push coalesced change events to all watchers"""
+        while True:
+            with self.events_condition:
+                while not self.pending_events:
+                    self.events_condition.wait()
+            
+            # Let a burst of changes settle so it goes out as one message
+            time.sleep(self.event_coalesce_interval)
+            
+            with self.events_condition:
+                events = list(self.pending_events.values())
+                self.pending_events = {}
+            
+            message = (json.dumps({'status': 'event', 'events': events}) + '\n').encode('utf-8')
+            with self.watchers_lock:
+                watchers = list(self.watchers.items())
+            for watcher, watcher_events in watchers:
+                try:
+                    watcher_events.put_nowait(message)
+                except queue.Full:
+                    logging.warning("Dropping a watcher that is not reading change events")
+                    self.drop_watcher(watcher)
+            
+            logging.info(f"Pushed {len(events)} change events to watchers")
 
 if __name__ == "__main__":
     server = FileServer()
@@ -0,0 +1,139 @@
+import cProfile
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+class Span:
+    """A timed phase of a command, with a byte count and extra attributes"""
+
+    def __init__(self, name, category, args):
+        self.name = name
+        self.category = category
+        self.args = args
+        self.bytes = 0
+        self.start = time.perf_counter()
+
+    def add_bytes(self, size):
+        self.bytes += size
+
+class Tracer:
+    """Records per-phase spans for server commands.
+
+    Every finished span is passed to the registered hooks as a dict and,
+    when a trace file is configured, kept for export in Chrome trace
+    format (load it in chrome://tracing or Perfetto). With
+    profile_sample_rate above zero, that fraction of commands also runs
+    under cProfile and its stats are dumped to profile_dir. Only one
+    command is profiled at a time. Since Python 3.12 cProfile is
+    process-wide, so a profile also covers whatever other handler threads
+    ran meanwhile.
+    """
+
+    def __init__(self, trace_file=None, profile_sample_rate=0.0, profile_dir='profiles', max_spans=100000):
+        self.trace_file = trace_file
+        self.profile_sample_rate = profile_sample_rate
+        self.profile_dir = profile_dir
+        self.hooks = []
+        self.spans = deque(maxlen=max_spans)
+        self.lock = threading.Lock()
+        self.profile_lock = threading.Lock()
+        self.pid = os.getpid()
+        # Chrome traces use microsecond timestamps; anchor perf_counter to wall time
+        self.time_offset = time.time() - time.perf_counter()
+
+    @property
+    def enabled(self):
+        return bool(self.hooks) or self.trace_file is not None
+
+    def add_hook(self, hook):
+        """Call hook(span) with a dict for every finished span"""
+        self.hooks.append(hook)
+
+    @contextmanager
+    def span(self, name, category='server', **args):
+        """Time the enclosed block as one span"""
+        if not self.enabled:
+            yield Span(name, category, args)
+            return
+
+        span = Span(name, category, args)
+        try:
+            yield span
+        finally:
+            self.record(name, span.start, time.perf_counter() - span.start,
+                        category=category, size=span.bytes, **span.args)
+
+    def record(self, name, start, duration, category='server', size=0, **args):
+        """Record a span measured by the caller, e.g. time summed over a loop"""
+        if not self.enabled:
+            return
+
+        args['bytes'] = size
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': (start + self.time_offset) * 1000000,
+            'dur': duration * 1000000,
+            'pid': self.pid,
+            'tid': threading.get_ident(),
+            'args': args
+        }
+        if self.trace_file is not None:
+            with self.lock:
+                self.spans.append(event)
+        for hook in self.hooks:
+            try:
+                hook(event)
+            except Exception as e:
+                logging.error(f"Error in trace hook: {e}")
+
+    @contextmanager
+    def profile(self, command):
+        """Run the enclosed block under cProfile for a sampled share of calls"""
+        if self.profile_sample_rate <= 0 or random.random() >= self.profile_sample_rate:
+            yield
+            return
+
+        # Skip the sample while another command is being profiled
+        if not self.profile_lock.acquire(blocking=False):
+            yield
+            return
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError as e:
+            # Another profiling tool, such as a debugger, is already active
+            self.profile_lock.release()
+            logging.warning(f"Skipping {command} profile: {e}")
+            yield
+            return
+        try:
+            yield
+        finally:
+            profiler.disable()
+            self.profile_lock.release()
+            os.makedirs(self.profile_dir, exist_ok=True)
+            stats_path = os.path.join(
+                self.profile_dir,
+                f"{command.lower()}-{threading.get_ident()}-{time.time_ns()}.prof"
+            )
+            profiler.dump_stats(stats_path)
+            logging.info(f"Saved {command} profile to {stats_path}")
+
+    def export(self, path=None):
+        """Write recorded spans to a Chrome trace JSON file"""
+        path = path or self.trace_file
+        if path is None:
+            return
+        with self.lock:
+            events = list(self.spans)
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+        logging.info(f"Exported {len(events)} trace spans to {path}")
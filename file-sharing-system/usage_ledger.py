@@ -0,0 +1,128 @@
+import json
+import logging
+import os
+import threading
+
+class UsageLedger:
+    """Persistent per-user storage usage, kept up to date incrementally.
+
+    Every change is appended to a JSON-lines journal and applied to
+    in-memory totals, so quota checks never walk the storage directory.
+    On startup the journal is replayed; once it grows well past the
+    number of tracked files it is compacted into a fresh snapshot.
+
+    Uploads reserve their size at header time so concurrent uploads by
+    the same user cannot overshoot the quota together.
+    """
+
+    def __init__(self, ledger_file, quotas=None, default_quota=None):
+        self.ledger_file = ledger_file
+        self.quotas = quotas or {}
+        self.default_quota = default_quota
+        self.lock = threading.Lock()
+        self.usage = {}
+        self.reserved = {}
+        self.owners = {}
+        self.journal_entries = 0
+        self.is_new = not os.path.exists(self.ledger_file)
+
+        if not self.is_new:
+            self.replay()
+        self.journal = open(self.ledger_file, 'a', encoding='utf-8')
+
+    def replay(self):
+        with open(self.ledger_file, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A torn final write from a crash; everything before it is intact
+                    logging.error(f"Skipping unreadable ledger entry in {self.ledger_file}")
+                    continue
+                self.apply(entry)
+                self.journal_entries += 1
+        logging.info(f"Loaded usage for {len(self.usage)} users and {len(self.owners)} files")
+
+    def apply(self, entry):
+        name = entry['name']
+        previous = self.owners.pop(name, None)
+        if previous is not None:
+            self.usage[previous[0]] = self.usage.get(previous[0], 0) - previous[1]
+        if entry['op'] == 'add':
+            self.owners[name] = (entry['user'], entry['size'])
+            self.usage[entry['user']] = self.usage.get(entry['user'], 0) + entry['size']
+
+    def record(self, entry):
+        self.apply(entry)
+        self.journal.write(json.dumps(entry) + '\n')
+        self.journal.flush()
+        self.journal_entries += 1
+        if self.journal_entries > 2 * len(self.owners) + 1000:
+            self.compact()
+
+    def compact(self):
+        """Rewrite the journal as one entry per tracked file"""
+        temp_path = self.ledger_file + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            for name, (user, size) in self.owners.items():
+                f.write(json.dumps({'op': 'add', 'name': name, 'user': user, 'size': size}) + '\n')
+        self.journal.close()
+        os.replace(temp_path, self.ledger_file)
+        self.journal = open(self.ledger_file, 'a', encoding='utf-8')
+        self.journal_entries = len(self.owners)
+
+    def seed(self, files, user):
+        """Charge (name, size) files the ledger has no owner for to user"""
+        with self.lock:
+            for name, size in files:
+                if name not in self.owners:
+                    entry = {'op': 'add', 'name': name, 'user': user, 'size': size}
+                    self.apply(entry)
+                    self.journal.write(json.dumps(entry) + '\n')
+                    self.journal_entries += 1
+            self.journal.flush()
+        logging.info(f"Charged {len(files)} existing files to {user}")
+
+    def quota_for(self, user):
+        return self.quotas.get(user, self.default_quota)
+
+    def reserve(self, user, size, replaced=None):
+        """Reserve space for an upload, or return False if it would exceed the quota.
+
+        replaced names a file the upload will overwrite; its size is
+        credited back if the same user owns it.
+        """
+        with self.lock:
+            quota = self.quota_for(user)
+            if quota is not None:
+                credit = 0
+                owner = self.owners.get(replaced)
+                if owner is not None and owner[0] == user:
+                    credit = owner[1]
+                projected = self.usage.get(user, 0) + self.reserved.get(user, 0) + size - credit
+                if projected > quota:
+                    return False
+            self.reserved[user] = self.reserved.get(user, 0) + size
+            return True
+
+    def release(self, user, size):
+        """Give back a reservation for an upload that did not complete"""
+        with self.lock:
+            self.reserved[user] = self.reserved.get(user, 0) - size
+
+    def commit(self, name, user, size, reserved_size=None):
+        """Charge a completed upload to user, replacing any previous owner of name"""
+        with self.lock:
+            self.reserved[user] = self.reserved.get(user, 0) - (size if reserved_size is None else reserved_size)
+            self.record({'op': 'add', 'name': name, 'user': user, 'size': size})
+
+    def remove(self, name):
+        """Credit a deleted or pruned file back to its owner"""
+        with self.lock:
+            if name in self.owners:
+                self.record({'op': 'remove', 'name': name})
+
+    def usage_for(self, user):
+        """Return (used, reserved, quota) for user"""
+        with self.lock:
+            return self.usage.get(user, 0), self.reserved.get(user, 0), self.quota_for(user)